@@ -32,6 +32,11 @@ README = (HERE / "README.md").read_text(encoding='utf8')
 # Add possible dependencies here
 DEPENDENCIES = ["markdown2"]
 
+# Optional dependencies, e.g. pip install fictionbook[lxml]
+EXTRAS = {
+    "lxml": ["lxml"],
+}
+
 # Github download link
 GITHUB_URL = "https://github.com/yuchdev/{PACKAGE_NAME}"
 
@@ -90,4 +95,5 @@ setup(
     package_data={PACKAGE_NAME: ['defaults/*']},
     python_requires=">=3.8",
     install_requires=DEPENDENCIES,
+    extras_require=EXTRAS,
 )
@@ -0,0 +1,121 @@
+import os
+import sys
+import glob
+import time
+import base64
+import argparse
+import tempfile
+
+from fictionbook.backends import available_backends, get_backend
+from fictionbook.reader import Fb2Reader
+from fictionbook.text_engine import extract_text
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'test', 'assets')
+
+
+def make_synthetic_book(file_path, sections, paragraphs_per_section, binary_size):
+    """
+    Write a synthetic FB2 book of the given shape
+    :param file_path: path of the book
+    :param sections: number of top-level sections
+    :param paragraphs_per_section: number of paragraphs in every section
+    :param binary_size: size of the embedded binary in bytes, 0 for none
+    """
+    paragraph = "Lorem ipsum <emphasis>dolor</emphasis> sit amet, consectetur adipiscing elit. " * 4
+    with open(file_path, 'w', encoding='utf-8') as book_file:
+        book_file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" '
+                        'xmlns:l="http://www.w3.org/1999/xlink">\n'
+                        '<description><title-info><book-title>Synthetic</book-title>'
+                        '<coverpage><image l:href="#cover.jpg"/></coverpage></title-info></description>\n'
+                        '<body>\n')
+        for section in range(sections):
+            book_file.write(f'<section id="s{section}"><title><p>Chapter {section}</p></title>\n')
+            for _ in range(paragraphs_per_section):
+                book_file.write(f'<p>{paragraph}</p>\n')
+            book_file.write('</section>\n')
+        book_file.write('</body>\n')
+        if binary_size:
+            book_file.write('<binary id="cover.jpg" content-type="image/jpeg">')
+            book_file.write(base64.encodebytes(os.urandom(binary_size)).decode('ascii'))
+            book_file.write('</binary>\n')
+        book_file.write('</FictionBook>\n')
+
+
+def measure(file_path, backend, repeat, **reader_options):
+    """
+    :return: best parse throughput in MB/s
+    """
+    size = os.path.getsize(file_path)
+    best = None
+    with tempfile.TemporaryDirectory() as images_dir:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            reader = Fb2Reader(file_path, images_dir, backend=backend, **reader_options)
+            len(reader.paragraphs)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    return size / best / 1024 / 1024
+
+
+def measure_text_engine(file_path, repeat):
+    """
+    :return: best throughput of the expat text engine in MB/s
+    """
+    size = os.path.getsize(file_path)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extract_text(file_path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best / 1024 / 1024
+
+
+def benchmark(file_paths, repeat):
+    backends = available_backends()
+    columns = backends + ['text']
+    print(f"{'book':<40} {'size, MB':>9} " + ' '.join(f'{name:>10}' for name in columns) + '   (MB/s)')
+    for file_path in file_paths:
+        size = os.path.getsize(file_path) / 1024 / 1024
+        results = [measure(file_path, get_backend(name), repeat) for name in backends]
+        results.append(measure_text_engine(file_path, repeat))
+        print(f"{os.path.basename(file_path):<40} {size:>9.2f} " + ' '.join(f'{mbs:>10.1f}' for mbs in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse throughput of the FB2 parser backends "
+                                                 "and of the expat text engine ('text' column)")
+    parser.add_argument("books",
+                        nargs="*",
+                        help="FB2 books to parse, test assets if none")
+    parser.add_argument("--sections",
+                        type=int,
+                        default=200,
+                        help="Number of sections of the synthetic large book, 0 to skip it")
+    parser.add_argument("--paragraphs",
+                        type=int,
+                        default=500,
+                        help="Number of paragraphs per section of the synthetic large book")
+    parser.add_argument("--binary-size",
+                        type=int,
+                        default=4 * 1024 * 1024,
+                        help="Size of the binary embedded into the synthetic large book")
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=3,
+                        help="Number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    books = args.books or sorted(glob.glob(os.path.join(ASSETS_DIR, '*.fb2')))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.sections:
+            synthetic_path = os.path.join(temp_dir, 'synthetic_large.fb2')
+            make_synthetic_book(synthetic_path, args.sections, args.paragraphs, args.binary_size)
+            books.append(synthetic_path)
+        benchmark(books, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import xml.etree.ElementTree as et
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+
+class ElementTreeBackend:
+    """
+    Parser backend on the standard library xml.etree.ElementTree
+    """
+    name = 'etree'
+
+    def parse(self, source):
+        """
+        :param source: path or binary file object
+        :return: root element
+        """
+        return et.parse(source).getroot()
+
+    def iterparse(self, source, events=('end',)):
+        return et.iterparse(source, events=events)
+
+    def feed_parser(self):
+        """
+        Incremental parser with feed() and close() methods, close() returns the root element
+        """
+        return et.XMLParser()
+
+    def to_etree(self, elem):
+        """
+        Convert the element to xml.etree.ElementTree, e.g. to pickle it
+        """
+        return elem
+
+
+class LxmlBackend:
+    """
+    Parser backend on lxml.etree, usually several times faster than the standard library.
+    Comments and processing instructions are dropped, the same way as ElementTree does.
+    """
+    name = 'lxml'
+
+    def __init__(self, huge_tree=True, recover=False):
+        """
+        :param huge_tree: If true, lift libxml2 limits on the tree depth and the text node size,
+        which large base64 binaries may exceed
+        :param recover: If true, try to parse broken XML instead of failing
+        """
+        if lxml is None:
+            raise ImportError("lxml is not installed")
+        self.huge_tree = huge_tree
+        self.recover = recover
+
+    def _parser_options(self):
+        return {
+            'huge_tree': self.huge_tree,
+            'recover': self.recover,
+            'remove_comments': True,
+            'remove_pis': True,
+            'resolve_entities': False,
+        }
+
+    def parse(self, source):
+        return lxml.etree.parse(source, parser=self.feed_parser()).getroot()
+
+    def iterparse(self, source, events=('end',)):
+        return lxml.etree.iterparse(source, events=events, **self._parser_options())
+
+    def feed_parser(self):
+        return lxml.etree.XMLParser(**self._parser_options())
+
+    def to_etree(self, elem):
+        converted = et.fromstring(lxml.etree.tostring(elem, with_tail=False))
+        converted.tail = elem.tail
+        return converted
+
+
+BACKENDS = {
+    'etree': ElementTreeBackend,
+    'lxml': LxmlBackend,
+}
+
+
+def available_backends():
+    """
+    :return: names of the backends that can be used in this environment
+    """
+    return [name for name in BACKENDS if name != 'lxml' or lxml is not None]
+
+
+def get_backend(backend=None, **options):
+    """
+    Resolve the parser backend
+    :param backend: backend instance, its name ('etree', 'lxml'), or 'auto' for lxml if installed
+    and ElementTree otherwise; None is the ElementTree backend
+    :param options: backend options, e.g. huge_tree and recover for lxml
+    :return: backend instance
+    """
+    if backend is None:
+        backend = 'etree'
+    if not isinstance(backend, str):
+        return backend
+    if backend == 'auto':
+        backend = 'lxml' if lxml is not None else 'etree'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend}")
+    if backend == 'lxml':
+        return LxmlBackend(**options)
+    return BACKENDS[backend]()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import base64
+import xml.parsers.expat
+
+from fictionbook.sources import open_book
+
+FB2_NAMESPACE = '{http://www.gribuser.ru/xml/fictionbook/2.0}'
+XLINK_NAMESPACE = '{http://www.w3.org/1999/xlink}'
+
+# Size of the chunks read from the book and written to image files
+CHUNK_SIZE = 64 * 1024
+
+# Bytes per base64 line of 76 characters, the line length of base64.encodebytes()
+BASE64_LINE_BYTES = 57
+# Bytes of binary data encoded at once, a whole number of base64 lines
+BASE64_CHUNK_SIZE = BASE64_LINE_BYTES * 1024
+
+# Expat reports namespaced names as 'namespace-uri local-name'
+EXPAT_NAMESPACE_SEPARATOR = ' '
+EXPAT_FB2_NAMESPACE = 'http://www.gribuser.ru/xml/fictionbook/2.0 '
+
+# Attributes of a tag, quoted attribute values may contain '>'
+TAG_ATTRIBUTES = rb'(?:[^\'">]|"[^"]*"|\'[^\']*\')*'
+# Rest of a tag up to its closing '>' or '/>'
+TAG_END_PATTERN = re.compile(TAG_ATTRIBUTES + rb'>')
+
+# Byte-level patterns for the pre-scan of <binary> elements, the namespace prefix is optional
+BINARY_START_PATTERN = re.compile(rb'<((?:[\w.-]+:)?binary)(?=[\s/>])(' + TAG_ATTRIBUTES + rb')>')
+ATTRIBUTE_PATTERN = re.compile(rb'([\w.:-]+)\s*=\s*(["\'])(.*?)\2', re.DOTALL)
+ENCODING_PATTERN = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([\w.-]+)["\']')
+
+
+class Base64StreamDecoder:
+    """
+    Incremental base64 decoder, writes decoded bytes to a binary file object as base64 text arrives.
+    Only the incomplete 4-character group is kept between calls, so memory doesn't depend on the data size.
+    """
+
+    def __init__(self, output):
+        """
+        :param output: binary file object to write decoded data to
+        """
+        self.output = output
+        self._pending = b''
+
+    def feed(self, data):
+        """
+        Decode the next portion of base64 text, whitespace and line breaks are allowed anywhere
+        :param data: str or bytes
+        """
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        data = self._pending + data.translate(None, b' \t\r\n')
+        complete = len(data) - len(data) % 4
+        if complete:
+            self.output.write(base64.b64decode(data[:complete]))
+        self._pending = data[complete:]
+
+    def close(self):
+        """
+        Decode the remaining characters, tolerating the missing padding
+        """
+        if self._pending:
+            self.output.write(base64.b64decode(self._pending + b'=' * (-len(self._pending) % 4)))
+            self._pending = b''
+
+
+def iter_base64_lines(file_object):
+    """
+    Encode a binary file to base64 in BASE64_CHUNK_SIZE pieces, wrapped into lines of 76 characters,
+    so only a single chunk is in memory at a time
+    :param file_object: binary file object
+    :return: generator of base64 text chunks, bytes, every one ends with a line break
+    """
+    while True:
+        chunk = file_object.read(BASE64_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield base64.encodebytes(chunk)
+
+
+class Fb2Binary:
+    """
+    Entry of the lazy binary index: a <binary> element of the book that is decoded on demand
+    """
+    __slots__ = ('id', 'content_type', 'element', 'file_path', 'offset', 'length')
+
+    def __init__(self, binary_id, content_type, element=None, file_path=None, offset=None, length=None):
+        """
+        Location of the binary is either the <binary> element itself,
+        or the byte range of its base64 text in the book file.
+        :param binary_id: value of the 'id' attribute, used in <image l:href="#id">
+        :param content_type: value of the 'content-type' attribute, e.g. 'image/jpeg'
+        :param element: the <binary> element
+        :param file_path: path to the book file
+        :param offset: offset of the base64 text in the book file
+        :param length: length of the base64 text in bytes
+        """
+        self.id = binary_id
+        self.content_type = content_type
+        self.element = element
+        self.file_path = file_path
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return f"Fb2Binary(id={self.id!r}, content_type={self.content_type!r})"
+
+    @property
+    def file_name(self):
+        """
+        File name of the decoded binary, the extension is derived from the content type if id has none
+        """
+        image_name, ext = os.path.splitext(self.id)
+        if not ext and self.content_type:
+            ext = f".{self.content_type.split('/')[-1].lower()}"
+        return image_name + ext
+
+    def read(self):
+        """
+        Decode the binary
+        :return: decoded bytes
+        """
+        if self.element is not None:
+            return base64.b64decode(self.element.text or '')
+        with open(self.file_path, 'rb') as book_file:
+            book_file.seek(self.offset)
+            return base64.b64decode(book_file.read(self.length))
+
+    def iter_text(self):
+        """
+        Iterate base64 text of the binary in CHUNK_SIZE pieces
+        """
+        if self.element is not None:
+            text = self.element.text or ''
+            for start in range(0, len(text), CHUNK_SIZE):
+                yield text[start:start + CHUNK_SIZE]
+            return
+        with open(self.file_path, 'rb') as book_file:
+            book_file.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = book_file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def save(self, file_path):
+        """
+        Decode the binary into the file chunk by chunk, never holding the whole decoded image
+        :param file_path: path of the image file
+        """
+        with open(file_path, 'wb') as image_file:
+            decoder = Base64StreamDecoder(image_file)
+            for chunk in self.iter_text():
+                decoder.feed(chunk)
+            decoder.close()
+
+
+def detect_encoding(data):
+    """
+    Get the encoding from the XML declaration
+    :param data: bytes or mmap starting with the XML declaration
+    :return: encoding name, 'utf-8' if not declared
+    """
+    match = ENCODING_PATTERN.match(data[:200].lstrip(b'\xef\xbb\xbf'))
+    return match.group(1).decode('ascii') if match else 'utf-8'
+
+
+def scan_binaries(data, file_path=None):
+    """
+    Find <binary> elements at the byte level, without parsing XML.
+    FB2 places binaries after the bodies, and '<' can't appear inside the text, so a plain search is enough.
+    :param data: bytes or mmap of the book in an ASCII-compatible encoding
+    :param file_path: path to the book file, stored in the index entries
+    :return: list of (start, end, binary) tuples, where [start, end) is the byte range of the whole element
+    and binary is Fb2Binary pointing to the base64 text
+    """
+    return list(iter_binaries(data, file_path))
+
+
+def find_binary(data, binary_id, file_path=None):
+    """
+    Find a single <binary> element at the byte level, stopping as soon as it's found
+    :param data: bytes or mmap of the book in an ASCII-compatible encoding
+    :param binary_id: 'id' attribute of the binary
+    :param file_path: path to the book file, stored in the entry
+    :return: Fb2Binary pointing to the base64 text, None if not found
+    """
+    return next((binary for _, _, binary in iter_binaries(data, file_path) if binary.id == binary_id), None)
+
+
+def iter_binaries(data, file_path=None):
+    """
+    Lazy version of scan_binaries()
+    :return: generator of (start, end, binary) tuples
+    """
+    encoding = detect_encoding(data)
+    position = 0
+    while True:
+        match = BINARY_START_PATTERN.search(data, position)
+        if match is None:
+            break
+        tag_name, attributes = match.group(1), match.group(2)
+        attrs = {
+            name.decode(encoding): value.decode(encoding)
+            for name, _, value in ATTRIBUTE_PATTERN.findall(attributes)
+        }
+        if attributes.endswith(b'/'):
+            text_start = text_end = end = match.end()
+        else:
+            text_start = match.end()
+            text_end = data.find(b'</' + tag_name, text_start)
+            if text_end < 0:
+                raise ValueError(f"Unclosed <binary> element at offset {match.start()}")
+            end = data.find(b'>', text_end) + 1
+        binary = Fb2Binary(attrs.get('id'), attrs.get('content-type'),
+                           file_path=file_path, offset=text_start, length=text_end - text_start)
+        yield match.start(), end, binary
+        position = end
+
+
+def extract_binaries(source, images_dir, binary_ids=None):
+    """
+    Decode <binary> elements straight from the book to images_dir while the parser reads them.
+    The book is fed to expat in CHUNK_SIZE pieces and the base64 text is decoded as it arrives,
+    so neither the element text nor the decoded image is ever held in memory.
+    :param source: path to the FB2 file (optionally compressed), bytes or a binary file object
+    :param images_dir: directory to write the images to
+    :param binary_ids: ids of the binaries to extract, all of them if None
+    :return: dict of binary id to image path
+    """
+    extracted = {}
+    state = {'image_file': None, 'decoder': None}
+
+    def start_element(name, attrs):
+        if name != f'{EXPAT_FB2_NAMESPACE}binary':
+            return
+        binary_id = attrs.get('id')
+        if not binary_id or (binary_ids is not None and binary_id not in binary_ids):
+            return
+        binary = Fb2Binary(binary_id, attrs.get('content-type'), None)
+        image_path = os.path.join(images_dir, binary.file_name)
+        state['image_file'] = open(image_path, 'wb')
+        state['decoder'] = Base64StreamDecoder(state['image_file'])
+        extracted[binary_id] = image_path
+
+    def end_element(name):
+        if state['decoder'] is not None and name == f'{EXPAT_FB2_NAMESPACE}binary':
+            state['decoder'].close()
+            state['image_file'].close()
+            state['image_file'] = state['decoder'] = None
+
+    def character_data(data):
+        if state['decoder'] is not None:
+            state['decoder'].feed(data)
+
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=EXPAT_NAMESPACE_SEPARATOR)
+    parser.buffer_text = False
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    try:
+        with open_book(source) as book_file:
+            _feed_parser(parser, book_file, lambda: (
+                # Everything requested has been found, there's no need to read the rest
+                binary_ids is not None and len(extracted) == len(binary_ids) and state['decoder'] is None
+            ))
+    finally:
+        if state['image_file'] is not None:
+            state['image_file'].close()
+    return extracted
+
+
+def _feed_parser(parser, book_file, done=None):
+    """
+    Feed the expat parser with the book in CHUNK_SIZE pieces
+    :param parser: expat parser
+    :param book_file: binary file object
+    :param done: callable, checked after every chunk to stop early
+    """
+    while True:
+        chunk = book_file.read(CHUNK_SIZE)
+        parser.Parse(chunk, not chunk)
+        if not chunk or (done is not None and done()):
+            break
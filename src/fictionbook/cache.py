@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import hashlib
+
+# Bump when the snapshot layout changes, so old entries are ignored
+CACHE_VERSION = 1
+
+# Size of the head and tail of the file hashed into the cache key
+SAMPLE_SIZE = 64 * 1024
+
+CACHE_SUFFIX = '.fb2cache'
+
+
+def content_fingerprint(file_path, size):
+    """
+    Fast content hash of the book: its size, first and last SAMPLE_SIZE bytes,
+    so computing it doesn't cost a full read of a large file
+    :param file_path: path to the book
+    :param size: file size
+    :return: hex digest
+    """
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(file_path, 'rb') as book_file:
+        digest.update(book_file.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            book_file.seek(max(size - SAMPLE_SIZE, SAMPLE_SIZE))
+            digest.update(book_file.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class BookCache:
+    """
+    On-disk cache of parsed books: metadata, chapter tree, paragraphs and binary index, pickled.
+    Entries are keyed by the file path, size, mtime and content fingerprint,
+    the total size is capped and the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        """
+        :param cache_dir: cache directory, created if missing
+        :param max_bytes: size cap of all the entries
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, file_path):
+        """
+        Path of the cache entry for the current state of the book
+        :param file_path: path to the book
+        """
+        stat = os.stat(file_path)
+        key = '|'.join((
+            os.path.abspath(file_path),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+            content_fingerprint(file_path, stat.st_size),
+        ))
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + CACHE_SUFFIX)
+
+    def load(self, file_path):
+        """
+        :param file_path: path to the book
+        :return: snapshot dict, or None if the book isn't cached or has changed
+        """
+        entry_path = self.entry_path(file_path)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                snapshot = pickle.load(entry_file)
+        except OSError:
+            return None
+        except Exception:
+            # A truncated or corrupt entry can fail to unpickle in many ways, it's a cache miss
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('version') != CACHE_VERSION:
+            return None
+        # Mark the entry as recently used
+        os.utime(entry_path)
+        return snapshot
+
+    def store(self, file_path, snapshot):
+        """
+        :param file_path: path to the book
+        :param snapshot: dict to cache
+        """
+        entry_path = self.entry_path(file_path)
+        temp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as entry_file:
+            pickle.dump(dict(snapshot, version=CACHE_VERSION), entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits max_bytes
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, file_name))
+                except FileNotFoundError:
+                    # Evicted by another process
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, file_name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_SUFFIX):
+                os.remove(os.path.join(self.cache_dir, file_name))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import functools
+
+from fictionbook.library import book_summary, find_books, process_library
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    title TEXT,
+    authors TEXT,
+    genre TEXT,
+    lang TEXT,
+    sequence_name TEXT,
+    sequence_number TEXT,
+    cover TEXT,
+    paragraphs INTEGER,
+    error TEXT,
+    scanned_at REAL NOT NULL
+)
+"""
+
+BOOK_COLUMNS = ('path', 'size', 'mtime', 'hash', 'title', 'authors', 'genre', 'lang', 'sequence_name',
+                'sequence_number', 'cover', 'paragraphs', 'error', 'scanned_at')
+
+
+def file_hash(file_path):
+    """
+    Content hash of the file, read in chunks
+    :param file_path: path to the file
+    :return: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Catalog:
+    """
+    Incremental SQLite catalog of book metadata.
+    A rescan re-reads only books whose size, mtime and content hash changed:
+    unchanged size and mtime skip the book without opening it, and the hash is computed
+    only to tell a touched file from a modified one.
+    """
+
+    def __init__(self, db_path, images_dir=None):
+        """
+        :param db_path: path to the SQLite database, created if missing
+        :param images_dir: images directory of the readers, nothing is extracted there;
+        a temporary one per book, removed right after reading, if None
+        """
+        self.db_path = db_path
+        self.images_dir = images_dir
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, path):
+        """
+        Catalog record of the book
+        :param path: path to the book, as it was scanned
+        :return: dict or None
+        """
+        row = self.connection.execute("SELECT * FROM books WHERE path = ?", (path,)).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    def books(self):
+        """
+        Iterate all catalog records
+        """
+        for row in self.connection.execute("SELECT * FROM books ORDER BY path"):
+            yield self._row_to_dict(row)
+
+    def scan(self, directory, workers=None, chunk_size=16):
+        """
+        Bring the catalog in sync with the directory
+        :param directory: library root, searched recursively
+        :param workers: number of worker processes for the changed books, CPU count if None
+        :param chunk_size: number of books sent to a worker at once
+        :return: dict with the number of 'added', 'updated', 'touched', 'unchanged', 'removed' and 'failed' books
+        """
+        stats = dict.fromkeys(('added', 'updated', 'touched', 'unchanged', 'removed', 'failed'), 0)
+        known = {
+            row['path']: row for row in self.connection.execute("SELECT path, size, mtime, hash FROM books")
+        }
+        found = find_books(directory)
+
+        changed = {}
+        for path in found:
+            stat = os.stat(path)
+            row = known.get(path)
+            if row is not None and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime_ns:
+                stats['unchanged'] += 1
+                continue
+            content_hash = file_hash(path)
+            if row is not None and row['hash'] == content_hash:
+                # Same content, just a new mtime
+                self.connection.execute("UPDATE books SET size = ?, mtime = ? WHERE path = ?",
+                                        (stat.st_size, stat.st_mtime_ns, path))
+                stats['touched'] += 1
+                continue
+            changed[path] = (stat.st_size, stat.st_mtime_ns, content_hash)
+
+        if changed:
+            processor = functools.partial(book_summary, images_dir=self.images_dir)
+            for result in process_library(list(changed), processor, workers, chunk_size):
+                size, mtime, content_hash = changed[result.path]
+                self._store(result, size, mtime, content_hash)
+                if not result.ok:
+                    stats['failed'] += 1
+                stats['updated' if result.path in known else 'added'] += 1
+
+        directory_prefix = os.path.join(directory, '')
+        found = set(found)
+        removed = [path for path in known if path.startswith(directory_prefix) and path not in found]
+        self.connection.executemany("DELETE FROM books WHERE path = ?", [(path,) for path in removed])
+        stats['removed'] = len(removed)
+        self.connection.commit()
+        return stats
+
+    def _store(self, result, size, mtime, content_hash):
+        data = result.data or {}
+        sequence = data.get('sequence') or {}
+        record = {
+            'path': result.path,
+            'size': size,
+            'mtime': mtime,
+            'hash': content_hash,
+            'title': data.get('title'),
+            'authors': json.dumps(data.get('authors', []), ensure_ascii=False),
+            'genre': ','.join(data.get('genres', [])),
+            'lang': data.get('lang'),
+            'sequence_name': sequence.get('name'),
+            'sequence_number': sequence.get('number'),
+            'cover': data.get('cover'),
+            'paragraphs': data.get('paragraphs'),
+            'error': result.error,
+            'scanned_at': time.time(),
+        }
+        placeholders = ', '.join('?' for _ in BOOK_COLUMNS)
+        self.connection.execute(f"INSERT OR REPLACE INTO books ({', '.join(BOOK_COLUMNS)}) VALUES ({placeholders})",
+                                [record[column] for column in BOOK_COLUMNS])
+
+    @staticmethod
+    def _row_to_dict(row):
+        record = dict(row)
+        record['authors'] = json.loads(record['authors']) if record['authors'] else []
+        return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally catalog an FB2 library into SQLite")
+    parser.add_argument("library_dir",
+                        help="Directory with FB2 books, searched recursively")
+    parser.add_argument("--db",
+                        default="catalog.sqlite",
+                        help="Path to the SQLite catalog")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes, CPU count by default")
+    args = parser.parse_args()
+
+    with Catalog(args.db) as catalog:
+        stats = catalog.scan(args.library_dir, workers=args.workers)
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
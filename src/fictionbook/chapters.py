@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from fictionbook.binaries import FB2_NAMESPACE
+from fictionbook.text_store import FLAG_ANNOTATION, FLAG_CITE, FLAG_EPIGRAPH, FLAG_POEM, FLAG_TITLE
+
+# Style flags of the paragraphs inside these elements
+STYLE_FLAGS = {
+    f'{FB2_NAMESPACE}title': FLAG_TITLE,
+    f'{FB2_NAMESPACE}epigraph': FLAG_EPIGRAPH,
+    f'{FB2_NAMESPACE}cite': FLAG_CITE,
+    f'{FB2_NAMESPACE}poem': FLAG_POEM,
+    f'{FB2_NAMESPACE}annotation': FLAG_ANNOTATION,
+}
+
+
+class Fb2Chapter:
+    """
+    Node of the chapter tree: a <section> reduced to its title, id, depth and the range
+    of its paragraphs in the flat paragraph store. Keeps no reference to the element tree.
+    """
+    __slots__ = ('title', 'id', 'depth', 'start', 'end', 'children')
+
+    def __init__(self, title, chapter_id, depth, start, end=None):
+        """
+        :param title: plain text of the section <title>, None if there's no title
+        :param chapter_id: 'id' attribute of the section
+        :param depth: nesting level, 0 for top-level sections of the body
+        :param start: index of the first paragraph of the section
+        :param end: index after the last paragraph of the section, nested sections included
+        """
+        self.title = title
+        self.id = chapter_id
+        self.depth = depth
+        self.start = start
+        self.end = end
+        self.children = []
+
+    def __repr__(self):
+        return f"Fb2Chapter(title={self.title!r}, id={self.id!r}, depth={self.depth}, start={self.start}, end={self.end})"
+
+    def walk(self):
+        """
+        Iterate the chapter and all nested chapters in document order
+        """
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def _paragraph_text(elem):
+    """
+    Text of a paragraph, the same way as Fb2Reader.paragraphs gets it: None if there's no text at all
+    """
+    text_content = ''.join(elem.itertext())
+    return text_content.strip() if text_content else None
+
+
+def _title_text(section):
+    title = section.find(f'{FB2_NAMESPACE}title')
+    if title is None:
+        return None
+    return ' '.join(' '.join(''.join(elem.itertext()).split()) for elem in title) or None
+
+
+def build_text(body, depth=0, paragraphs=None, flags=None):
+    """
+    Collect paragraphs and the chapter tree in a single pass over the body
+    :param body: <body> or <section> element
+    :param depth: depth of the sections directly inside the element
+    :param paragraphs: list or ParagraphStore to append the paragraphs to, a new list if None
+    :param flags: list or array to append style flags (FLAG_* bits) of every paragraph to, not collected if None
+    :return: (paragraphs, chapters), where chapters are the top-level Fb2Chapter nodes
+    """
+    if paragraphs is None:
+        paragraphs = []
+    chapters = []
+    _collect(body, depth, 0, paragraphs, flags, chapters)
+    return paragraphs, chapters
+
+
+def _collect(elem, depth, style, paragraphs, flags, chapters):
+    for child in elem:
+        if child.tag == f'{FB2_NAMESPACE}section':
+            chapter = Fb2Chapter(_title_text(child), child.get('id'), depth, len(paragraphs))
+            _collect(child, depth + 1, 0, paragraphs, flags, chapter.children)
+            chapter.end = len(paragraphs)
+            chapters.append(chapter)
+            continue
+        if child.tag == f'{FB2_NAMESPACE}p':
+            text = _paragraph_text(child)
+            if text is not None:
+                paragraphs.append(text)
+                if flags is not None:
+                    flags.append(style)
+        _collect(child, depth, style | STYLE_FLAGS.get(child.tag, 0), paragraphs, flags, chapters)
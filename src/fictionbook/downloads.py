@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from fictionbook.binaries import CHUNK_SIZE
+
+# Redirect responses followed by the downloader
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+# Errors of a request sent on a kept-alive connection that the server has already closed
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class DownloadError(Exception):
+    """
+    Image couldn't be downloaded
+    """
+
+
+class ImageDownloader:
+    """
+    Concurrent image downloader with bounded concurrency, per-host connection reuse, timeouts, retries
+    and an optional on-disk cache. Cached entries are revalidated with ETag/Last-Modified,
+    so re-reading the same book doesn't download the images again.
+    One downloader may be shared by many readers.
+    """
+
+    def __init__(self, cache_dir=None, max_workers=8, timeout=10.0, retries=2, backoff=0.5):
+        """
+        :param cache_dir: directory of the download cache, no caching if None
+        :param max_workers: maximum number of concurrent downloads
+        :param timeout: socket timeout in seconds
+        :param retries: number of retries after a connection error or a 5xx response
+        :param backoff: delay before the first retry in seconds, doubled for every next one
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = None
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads and close the kept-alive connections
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def download(self, urls, target_dir):
+        """
+        Download images concurrently into target_dir, the file name is the last component of the URL path
+        :param urls: image URLs
+        :param target_dir: directory to save the images to
+        :return: dict of URL to image path, failed downloads are reported and skipped
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {url: self._executor.submit(self._download_to, url, target_dir) for url in dict.fromkeys(urls)}
+        downloaded = {}
+        for url, future in futures.items():
+            try:
+                downloaded[url] = future.result()
+            except (DownloadError, OSError, http.client.HTTPException) as e:
+                print(f"Error downloading image from {url}: {e}")
+        return downloaded
+
+    def _download_to(self, url, target_dir):
+        image_name = os.path.basename(urllib.parse.urlsplit(url).path) or hashlib.sha1(url.encode()).hexdigest()
+        image_path = os.path.join(target_dir, image_name)
+        if self.cache_dir is None:
+            self._fetch(url, image_path)
+        else:
+            shutil.copyfile(self._fetch_cached(url), image_path)
+        return image_path
+
+    def _fetch_cached(self, url):
+        """
+        Revalidate the cached copy of the URL, or download it into the cache
+        :return: path of the cached file
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        data_path = os.path.join(self.cache_dir, key)
+        meta_path = data_path + '.json'
+        headers = {}
+        if os.path.isfile(data_path) and os.path.isfile(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        temp_path = f'{data_path}.{threading.get_ident()}.tmp'
+        response_headers = self._fetch(url, temp_path, headers)
+        if response_headers is None:
+            # 304 Not Modified
+            return data_path
+        os.replace(temp_path, data_path)
+        meta = {
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+        }
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        return data_path
+
+    def _fetch(self, url, file_path, headers=None):
+        """
+        GET the URL into the file, retrying connection errors and server errors
+        :return: response headers, or None if the server answered 304 Not Modified
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._request(url, file_path, headers or {})
+            except (OSError, http.client.HTTPException, _ServerError) as e:
+                if attempt == self.retries:
+                    raise DownloadError(str(e)) from e
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _request(self, url, file_path, headers):
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path = f'{path}?{parts.query}'
+            response = self._send(parts.scheme, parts.netloc, path, headers)
+            if response.status in REDIRECT_CODES and response.getheader('Location'):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status == 304:
+                response.read()
+                return None
+            if response.status >= 500:
+                response.read()
+                raise _ServerError(f"HTTP {response.status} {response.reason}")
+            if response.status != 200:
+                response.read()
+                raise DownloadError(f"HTTP {response.status} {response.reason}")
+
+            with open(file_path, 'wb') as image_file:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    image_file.write(chunk)
+            return response.headers
+        raise DownloadError("Too many redirects")
+
+    def _send(self, scheme, netloc, path, headers):
+        """
+        GET the path over the kept-alive connection to the host. If the server has closed the idle connection,
+        the request is resent once over a new one, which doesn't count as a retry
+        :return: HTTPResponse
+        """
+        while True:
+            connection = self._connection(scheme, netloc)
+            reused = connection.sock is not None
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                self._drop_connection(scheme, netloc)
+                if not reused or not isinstance(e, STALE_CONNECTION_ERRORS):
+                    raise
+
+    def _connection(self, scheme, netloc):
+        """
+        Connection to the host, kept per thread, so requests to the same host reuse it
+        """
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == 'http':
+                connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise DownloadError(f"Unsupported URL scheme {scheme}")
+            connections[(scheme, netloc)] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self, scheme, netloc):
+        connection = getattr(self._local, 'connections', {}).pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+            with self._lock:
+                self._connections.remove(connection)
+
+
+class _ServerError(Exception):
+    """
+    5xx response, worth a retry
+    """
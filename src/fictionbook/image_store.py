@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from fictionbook.binaries import Base64StreamDecoder
+
+
+class _HashingWriter:
+    """
+    Binary file wrapper that hashes everything written through it
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.output.write(data)
+
+
+class ImageStore:
+    """
+    Content-addressed image store shared by many books.
+    Every image is stored once under the SHA-256 of its decoded bytes, so logos and series covers
+    repeated across a library take the space of a single file, and same-named ids of different
+    books never overwrite each other. A per-book manifest maps binary ids to store entries.
+    Layout:
+    * objects/<2 first hex digits>/<digest><ext> - image files
+    * manifests/<book key>.json - {binary id: {'digest': ..., 'content_type': ..., 'path': ...}}
+    """
+
+    def __init__(self, root):
+        """
+        :param root: store directory, created if missing
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.manifests_dir = os.path.join(root, 'manifests')
+        self.temp_dir = os.path.join(root, 'tmp')
+        for directory in (self.objects_dir, self.manifests_dir, self.temp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def object_path(self, digest, ext=''):
+        return os.path.join(self.objects_dir, digest[:2], digest + ext)
+
+    def put_binary(self, binary):
+        """
+        Decode the binary into the store, unless an identical image is already there
+        :param binary: Fb2Binary
+        :return: (digest, path of the store entry)
+        """
+        ext = os.path.splitext(binary.file_name)[1].lower()
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                writer = _HashingWriter(temp_file)
+                decoder = Base64StreamDecoder(writer)
+                for chunk in binary.iter_text():
+                    decoder.feed(chunk)
+                decoder.close()
+            digest = writer.digest.hexdigest()
+            object_path = self.object_path(digest, ext)
+            if os.path.exists(object_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_path, object_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest, object_path
+
+    def add_book(self, reader, book_key):
+        """
+        Put all the book binaries into the store and write the book manifest
+        :param reader: Fb2Reader
+        :param book_key: unique key of the book, used as the manifest name
+        :return: manifest dict
+        """
+        manifest = {}
+        for binary_id, binary in reader.binaries.items():
+            digest, object_path = self.put_binary(binary)
+            manifest[binary_id] = {
+                'digest': digest,
+                'content_type': binary.content_type,
+                'path': os.path.relpath(object_path, self.root),
+            }
+        manifest_path = self._manifest_path(book_key)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return manifest
+
+    def manifest(self, book_key):
+        """
+        :param book_key: key the book was added with
+        :return: manifest dict
+        """
+        with open(self._manifest_path(book_key), 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def image_path(self, book_key, binary_id):
+        """
+        Path of the store entry of the book image
+        :param book_key: key the book was added with
+        :param binary_id: id of the binary, '#' prefix is trimmed
+        """
+        if binary_id.startswith('#'):
+            binary_id = binary_id[1:]
+        return os.path.join(self.root, self.manifest(book_key)[binary_id]['path'])
+
+    def export_book(self, book_key, images_dir):
+        """
+        Make the book images available under their original names as hardlinks to the store entries,
+        copies are made only if hardlinks aren't supported
+        :param book_key: key the book was added with
+        :param images_dir: directory to place the images to
+        :return: list of image paths
+        """
+        os.makedirs(images_dir, exist_ok=True)
+        image_paths = []
+        for binary_id, entry in self.manifest(book_key).items():
+            image_name, ext = os.path.splitext(binary_id)
+            image_path = os.path.join(images_dir, image_name + (ext or os.path.splitext(entry['path'])[1]))
+            if os.path.exists(image_path):
+                os.remove(image_path)
+            object_path = os.path.join(self.root, entry['path'])
+            try:
+                os.link(object_path, image_path)
+            except OSError:
+                shutil.copyfile(object_path, image_path)
+            image_paths.append(image_path)
+        return image_paths
+
+    def _manifest_path(self, book_key):
+        safe_key = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in book_key)
+        if safe_key != book_key:
+            # Keep keys that differ only in replaced characters apart
+            safe_key += '-' + hashlib.sha1(book_key.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.manifests_dir, safe_key + '.json')
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import mmap
+import hashlib
+import xml.parsers.expat
+import xml.etree.ElementTree as et
+
+from fictionbook.binaries import (
+    CHUNK_SIZE, EXPAT_FB2_NAMESPACE, EXPAT_NAMESPACE_SEPARATOR, TAG_END_PATTERN, Fb2Binary, detect_encoding
+)
+from fictionbook.sources import is_plain_file
+
+# Bump when the index layout changes, so old sidecars are rebuilt
+INDEX_VERSION = 2
+
+# Suffix of the sidecar stored next to the book
+INDEX_SUFFIX = '.idx.json'
+
+
+class Fb2Index:
+    """
+    Persistent byte-offset index of a book: byte ranges of every body, every top-level section
+    of the bodies and every binary. Lets a single section be parsed without reading the rest of the file.
+    The index is stored as a JSON sidecar and is validated against the file size and mtime.
+    """
+
+    def __init__(self, file_path, data):
+        """
+        Use Fb2Index.open() to load or build the index
+        :param file_path: path to the FB2 file
+        :param data: dict with the index content
+        """
+        self.file_path = file_path
+        self.data = data
+
+    @classmethod
+    def open(cls, file_path, cache_dir=None):
+        """
+        Load the index of the book, build and store it if it's missing or stale
+        :param file_path: path to the FB2 file
+        :param cache_dir: directory to keep the index in, next to the book if None
+        :return: Fb2Index
+        """
+        index_path = cls.index_path(file_path, cache_dir)
+        stat = os.stat(file_path)
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as index_file:
+                    data = json.load(index_file)
+                if (data.get('version') == INDEX_VERSION and data.get('size') == stat.st_size
+                        and data.get('mtime') == stat.st_mtime_ns):
+                    return cls(file_path, data)
+            except ValueError:
+                # Corrupted sidecar, rebuild it
+                pass
+        index = cls.build(file_path)
+        index.save(index_path)
+        return index
+
+    @staticmethod
+    def index_path(file_path, cache_dir=None):
+        """
+        Path of the index sidecar
+        :param file_path: path to the FB2 file
+        :param cache_dir: directory to keep the index in, next to the book if None
+        """
+        file_path = os.fspath(file_path)
+        if cache_dir is None:
+            return file_path + INDEX_SUFFIX
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, key + INDEX_SUFFIX)
+
+    @classmethod
+    def build(cls, file_path):
+        """
+        Build the index with a single expat pass over the memory-mapped file
+        :param file_path: path to the FB2 file
+        :return: Fb2Index
+        """
+        if not is_plain_file(file_path):
+            raise ValueError("Byte-offset index requires an uncompressed FB2 file")
+        stat = os.stat(file_path)
+        with open(file_path, 'rb') as book_file:
+            with mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                builder = _IndexBuilder(data)
+                builder.parse()
+        index_data = {
+            'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'encoding': builder.encoding,
+            'root': builder.root,
+            'bodies': builder.bodies,
+            'binaries': builder.binaries,
+        }
+        return cls(file_path, index_data)
+
+    def save(self, index_path):
+        """
+        Store the index atomically
+        :param index_path: path of the index sidecar
+        """
+        index_dir = os.path.dirname(index_path)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        temp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(self.data, index_file, ensure_ascii=False)
+        os.replace(temp_path, index_path)
+
+    @property
+    def sections(self):
+        """
+        Top-level sections of the main body, each is a dict with 'id', 'start' and 'end' keys
+        """
+        return self.data['bodies'][0]['sections'] if self.data['bodies'] else []
+
+    def load_section(self, section, body=0):
+        """
+        Parse a single top-level section
+        :param section: number of the section in the body, or its 'id' attribute
+        :param body: number of the body, 0 is the main one
+        :return: <section> Element
+        """
+        sections = self.data['bodies'][body]['sections']
+        if isinstance(section, str):
+            matches = [entry for entry in sections if entry['id'] == section]
+            if not matches:
+                raise KeyError(f"Section {section} not found")
+            entry = matches[0]
+        else:
+            entry = sections[section]
+        return self._parse_slice(entry['start'], entry['end'])
+
+    def load_body(self, body=0):
+        """
+        Parse a single body
+        :param body: number of the body, 0 is the main one
+        :return: <body> Element
+        """
+        entry = self.data['bodies'][body]
+        return self._parse_slice(entry['start'], entry['end'])
+
+    def binary(self, binary_id):
+        """
+        Index entry of the binary, decoded on demand straight from the file
+        :param binary_id: 'id' attribute of the <binary> element
+        :return: Fb2Binary
+        """
+        entry = self.data['binaries'][binary_id]
+        return Fb2Binary(binary_id, entry['content_type'], file_path=self.file_path,
+                         offset=entry['offset'], length=entry['length'])
+
+    def _parse_slice(self, start, end):
+        """
+        Parse the byte range of the file, wrapped into the original root start tag,
+        so the namespace declarations are in place
+        """
+        root = self.data['root']
+        with open(self.file_path, 'rb') as book_file:
+            book_file.seek(root['start'])
+            root_tag = book_file.read(root['end'] - root['start'])
+            book_file.seek(start)
+            content = book_file.read(end - start)
+        parser = et.XMLParser(encoding=self.data['encoding'])
+        parser.feed(root_tag)
+        parser.feed(content)
+        parser.feed(f"</{root['name']}>".encode('ascii'))
+        return parser.close()[0]
+
+
+class _IndexBuilder:
+    """
+    Collects byte ranges from expat callbacks
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.encoding = detect_encoding(data)
+        self.root = None
+        self.bodies = []
+        self.binaries = {}
+        self.depth = 0
+        self.binary = None
+        # Whether the last start tag is self-closing; expat reports its end right after '/>'
+        self.empty = False
+        self.parser = xml.parsers.expat.ParserCreate(namespace_separator=EXPAT_NAMESPACE_SEPARATOR)
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+
+    def parse(self):
+        for start in range(0, len(self.data), CHUNK_SIZE):
+            self.parser.Parse(self.data[start:start + CHUNK_SIZE], False)
+        self.parser.Parse(b'', True)
+
+    def _tag_end(self, position):
+        """
+        :param position: offset of a start or end tag
+        :return: offset right after the tag
+        """
+        return TAG_END_PATTERN.match(self.data, position).end()
+
+    def start_element(self, name, attrs):
+        self.depth += 1
+        position = self.parser.CurrentByteIndex
+        self.empty = False
+        if self.depth > 3:
+            return
+        tag_end = self._tag_end(position)
+        self.empty = self.data[tag_end - 2:tag_end] == b'/>'
+        if self.depth == 1:
+            # The raw start tag keeps the namespace declarations as they are
+            qualified_name = self.data[position + 1:tag_end].split()[0].rstrip(b'/>')
+            self.root = {
+                'name': qualified_name.decode('ascii'),
+                'start': position,
+                'end': tag_end,
+            }
+        elif self.depth == 2 and name == f'{EXPAT_FB2_NAMESPACE}body':
+            self.bodies.append({'name': attrs.get('name'), 'start': position, 'end': None, 'sections': []})
+        elif self.depth == 2 and name == f'{EXPAT_FB2_NAMESPACE}binary':
+            if attrs.get('id'):
+                self.binary = {'content_type': attrs.get('content-type'), 'offset': tag_end}
+                self.binaries[attrs['id']] = self.binary
+        elif self.depth == 3 and name == f'{EXPAT_FB2_NAMESPACE}section' and self.bodies:
+            self.bodies[-1]['sections'].append({'id': attrs.get('id'), 'start': position, 'end': None})
+
+    def end_element(self, name):
+        position = self.parser.CurrentByteIndex
+        if self.depth > 3:
+            self.depth -= 1
+            return
+        end = position if self.empty else self._tag_end(position)
+        self.empty = False
+        if self.depth == 2 and name == f'{EXPAT_FB2_NAMESPACE}body':
+            self.bodies[-1]['end'] = end
+        elif self.depth == 2 and self.binary is not None:
+            self.binary['length'] = max(position - self.binary['offset'], 0)
+            self.binary = None
+        elif self.depth == 3 and name == f'{EXPAT_FB2_NAMESPACE}section' and self.bodies:
+            self.bodies[-1]['sections'][-1]['end'] = end
+        self.depth -= 1
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import argparse
+import tempfile
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from fictionbook.reader import FB2_NAMESPACE, Fb2Reader
+
+# Book files picked up when scanning a library directory
+BOOK_EXTENSIONS = ('.fb2', '.fb2.zip', '.fb2.gz')
+
+
+class BookResult:
+    """
+    Outcome of processing a single book: either the processor's data or the error
+    """
+    __slots__ = ('path', 'data', 'error')
+
+    def __init__(self, path, data=None, error=None):
+        """
+        :param path: path to the book
+        :param data: value returned by the processor
+        :param error: error description if the book failed
+        """
+        self.path = path
+        self.data = data
+        self.error = error
+
+    def __repr__(self):
+        return f"BookResult(path={self.path!r}, error={self.error!r})"
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        return {'path': self.path, 'data': self.data, 'error': self.error}
+
+
+def find_books(directory):
+    """
+    Recursively find FB2 books, including compressed ones
+    :param directory: library root
+    :return: sorted list of paths
+    """
+    books = []
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            if file_name.lower().endswith(BOOK_EXTENSIONS):
+                books.append(os.path.join(root, file_name))
+    return sorted(books)
+
+
+def _element_text(elem):
+    return ' '.join(''.join(elem.itertext()).split()) if elem is not None else ''
+
+
+def metadata_fields(description):
+    """
+    Flatten the most used metadata of the book
+    :param description: <description> element
+    :return: dict with 'title', 'authors', 'genres', 'lang' and 'sequence' keys
+    """
+    title_info = description.find(f'{FB2_NAMESPACE}title-info')
+    if title_info is None:
+        return {'title': '', 'authors': [], 'genres': [], 'lang': '', 'sequence': None}
+
+    authors = []
+    for author in title_info.findall(f'{FB2_NAMESPACE}author'):
+        names = [
+            _element_text(author.find(f'{FB2_NAMESPACE}{part}'))
+            for part in ('first-name', 'middle-name', 'last-name')
+        ]
+        name = ' '.join(part for part in names if part) or _element_text(author.find(f'{FB2_NAMESPACE}nickname'))
+        if name:
+            authors.append(name)
+
+    sequence = title_info.find(f'{FB2_NAMESPACE}sequence')
+    if sequence is not None and sequence.get('name'):
+        sequence = {'name': sequence.get('name'), 'number': sequence.get('number')}
+    else:
+        sequence = None
+
+    return {
+        'title': _element_text(title_info.find(f'{FB2_NAMESPACE}book-title')),
+        'authors': authors,
+        'genres': [_element_text(genre) for genre in title_info.findall(f'{FB2_NAMESPACE}genre')],
+        'lang': _element_text(title_info.find(f'{FB2_NAMESPACE}lang')),
+        'sequence': sequence,
+    }
+
+
+def book_summary(file_path, images_dir=None, metadata_only=False):
+    """
+    Default book processor: read the book and summarize it. Images are not extracted,
+    binaries are skipped at the byte level.
+    :param file_path: path to the book
+    :param images_dir: images directory of the reader, a temporary one removed right after reading if None
+    :param metadata_only: If true, don't parse the body
+    :return: JSON-serializable dict
+    """
+    if images_dir is None and not metadata_only:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            return book_summary(file_path, temp_dir)
+    # A metadata-only reader never touches images_dir
+    reader = Fb2Reader(file_path, images_dir=images_dir or '', metadata_only=metadata_only, skip_binaries=True)
+    summary = metadata_fields(reader.metadata)
+    summary['cover'] = reader.cover_image
+    if not metadata_only:
+        summary['paragraphs'] = len(reader.paragraphs)
+        summary['binaries'] = len(reader.binaries)
+    return summary
+
+
+def book_stem(file_path):
+    """
+    File name of the book without the book extension, e.g. 'frost' for 'frost.fb2.zip'
+    """
+    file_name = os.path.basename(file_path)
+    for extension in BOOK_EXTENSIONS:
+        if file_name.lower().endswith(extension):
+            return file_name[:-len(extension)]
+    return file_name
+
+
+def book_cover(file_path, covers_dir='covers'):
+    """
+    Cover processor: decode only the cover of the book, named after the book file
+    :param file_path: path to the book
+    :param covers_dir: directory to write the cover to
+    :return: JSON-serializable dict with the 'cover' path, None if the book has no cover
+    """
+    return {'cover': Fb2Reader.extract_cover(file_path, covers_dir, image_name=book_stem(file_path))}
+
+
+def extract_covers(directory, covers_dir, workers=None, chunk_size=8):
+    """
+    Extract covers of all the books of a library, e.g. to generate thumbnails
+    :param directory: library root, searched recursively
+    :param covers_dir: directory to write the covers to, each one is named after its book file
+    :param workers: number of worker processes, CPU count if None
+    :param chunk_size: number of books sent to a worker at once
+    :return: generator of BookResult
+    """
+    os.makedirs(covers_dir, exist_ok=True)
+    processor = functools.partial(book_cover, covers_dir=covers_dir)
+    return process_library(find_books(directory), processor, workers, chunk_size)
+
+
+def _process_chunk(processor, paths):
+    """
+    Worker entry point: process a chunk of books, isolating the errors of every book
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(BookResult(path, data=processor(path)))
+        except Exception as e:
+            results.append(BookResult(path, error=f"{type(e).__name__}: {e}"))
+    return results
+
+
+def process_library(paths, processor=book_summary, workers=None, chunk_size=1):
+    """
+    Process books across a pool of worker processes.
+    Results are yielded in completion order; a failed book is reported in its BookResult
+    and doesn't stop the run, even if it takes down its worker process: the pool is recreated,
+    the chunks that were sent to the workers at the time are retried one by one in a process of their own
+    to find the crashing book, and the rest of the chunks are processed in the new pool.
+    :param paths: paths to the books
+    :param processor: picklable callable that takes a book path, e.g. a module-level function or functools.partial
+    :param workers: number of worker processes, CPU count if None
+    :param chunk_size: number of books sent to a worker at once, larger chunks cut the IPC overhead for small books
+    :return: generator of BookResult
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    workers = workers or os.cpu_count() or 1
+    paths = list(paths)
+    chunks = [paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size)]
+    while chunks:
+        broken = yield from _run_chunks(processor, chunks, workers)
+        # The pool feeds the workers in submission order, so the crash is in one of the first chunks left:
+        # up to one per worker being processed and as many plus one queued to them
+        suspects = broken[:2 * workers + 1]
+        chunks = broken[2 * workers + 1:]
+        for chunk in suspects:
+            crashed = yield from _run_chunks(processor, [chunk], 1)
+            if crashed and len(chunk) > 1:
+                # Results of a crashed chunk are lost, process its books one by one to find the crashing one
+                crashed = []
+                for path in chunk:
+                    crashed.extend((yield from _run_chunks(processor, [[path]], 1)))
+            for crashed_chunk in crashed:
+                yield from (BookResult(path, error="BrokenProcessPool: the worker process crashed")
+                            for path in crashed_chunk)
+
+
+def _run_chunks(processor, chunks, workers):
+    """
+    Process the chunks in a new pool of worker processes and yield the results
+    :return: chunks left unprocessed because a worker process crashed, in submission order
+    """
+    broken = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        futures = {}
+        for index, chunk in enumerate(chunks):
+            try:
+                futures[executor.submit(_process_chunk, processor, chunk)] = index
+            except BrokenProcessPool:
+                broken.extend(range(index, len(chunks)))
+                break
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+                continue
+            except Exception as e:
+                # The result couldn't be transferred back, fail the whole chunk
+                error = f"{type(e).__name__}: {e}"
+                results = [BookResult(path, error=error) for path in chunks[futures[future]]]
+            yield from results
+    return [chunks[index] for index in sorted(broken)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process an FB2 library in parallel")
+    parser.add_argument("library_dir",
+                        help="Directory with FB2 books, searched recursively")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes, CPU count by default")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=1,
+                        help="Number of books sent to a worker at once")
+    parser.add_argument("--metadata-only",
+                        action="store_true",
+                        help="Read only metadata, don't parse the body")
+    parser.add_argument("--images-dir",
+                        default=None,
+                        help="Images directory of the readers, a temporary one per book by default")
+    parser.add_argument("--covers-dir",
+                        default=None,
+                        help="Extract only the book covers to this directory instead of summarizing the books")
+    args = parser.parse_args()
+
+    if args.covers_dir:
+        os.makedirs(args.covers_dir, exist_ok=True)
+        processor = functools.partial(book_cover, covers_dir=args.covers_dir)
+    else:
+        processor = functools.partial(book_summary, images_dir=args.images_dir, metadata_only=args.metadata_only)
+    failed = 0
+    for result in process_library(find_books(args.library_dir), processor, args.workers, args.chunk_size):
+        if not result.ok:
+            failed += 1
+            print(f"Error processing {result.path}: {result.error}", file=sys.stderr)
+        print(json.dumps(result.to_dict(), ensure_ascii=False))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+import re
+from html.parser import HTMLParser
+from xml.etree.ElementTree import Element, SubElement
+
+import markdown2
+
+# markdown2 extras: [^1] footnotes and ~~strikethrough~~
+MARKDOWN_EXTRAS = ["footnotes", "strike"]
+
+# HTML inline elements and their FB2 counterparts
+INLINE_TAGS = {
+    'em': 'emphasis',
+    'i': 'emphasis',
+    'strong': 'strong',
+    'b': 'strong',
+    'code': 'code',
+    'del': 'strikethrough',
+    's': 'strikethrough',
+    'strike': 'strikethrough',
+    'sub': 'sub',
+    'sup': 'sup',
+}
+HEADING_TAGS = {f'h{level}': level for level in range(1, 7)}
+VOID_TAGS = ('br', 'hr', 'img', 'wbr')
+
+# The last line of a quote starting with a dash is its author, e.g. "-- Author"
+TEXT_AUTHOR_PATTERN = re.compile(r'(?:^|\n)[ \t]*(?:--|—|―)[ \t]*(\S[^\n]*)$')
+LIST_BULLET = '• '
+
+
+def image_href(src):
+    """
+    Images are embedded as binaries named by their file names, so a local path becomes
+    a reference to the binary; external links are kept as they are
+    :param src: image path or URL
+    :return: l:href value
+    """
+    if '://' in src or src.startswith(('#', 'data:')):
+        return src
+    return '#' + src.rsplit('/', 1)[-1]
+
+
+class MarkdownConverter(HTMLParser):
+    """
+    Single-pass converter of the HTML rendered by markdown2 into FB2 elements, appended to the body
+    as the tokens come, without intermediate strings or trees:
+    * headings - nested sections with titles, by the heading level
+    * paragraphs, emphasis, strong, code, strikethrough, sub/sup and links
+    * a blockquote at the start of a section - epigraph, any other one - cite;
+      its last line starting with a dash - text-author
+    * lists - paragraphs with bullets or numbers, code blocks - paragraphs of code
+    * horizontal rules - empty lines, images - image elements
+    * footnotes - sections of the notes body, references to them - <a type="note">
+    Content before the first heading goes into an untitled section.
+    """
+
+    def __init__(self, body, notes_title='Notes'):
+        """
+        :param body: main body Element to fill
+        :param notes_title: title of the notes body
+        """
+        super().__init__(convert_charrefs=True)
+        self.body = body
+        self.notes = None
+        self.notes_title = notes_title
+        self._root = body
+        self._in_notes = False
+        self._note_count = 0
+        # (heading level, section) of the open sections, level 0 is the untitled section
+        # before the first heading, which is closed by any heading
+        self._sections = []
+        # Open cite and epigraph elements
+        self._blocks = []
+        # (HTML tag, end handler or None) of the open HTML elements
+        self._open = []
+        self._paragraph = None
+        self._paragraph_parent = None
+        # Open inline elements, the paragraph itself first
+        self._inline = []
+        # [ordered, item count] of the open lists
+        self._lists = []
+        self._prefix = None
+        # Text parts of the open <pre> block
+        self._pre = None
+        # Depth of the elements whose content is dropped
+        self._skip = 0
+        self._in_note_ref = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip:
+            if tag not in VOID_TAGS:
+                self._open.append((tag, None))
+            return
+        attrs = dict(attrs)
+        end = None
+        if tag in HEADING_TAGS:
+            end = self._start_heading(HEADING_TAGS[tag], attrs.get('id'))
+        elif tag == 'p':
+            self._close_paragraph()
+            self._open_paragraph()
+            end = self._close_paragraph
+        elif tag == 'blockquote':
+            end = self._start_quote()
+        elif tag in ('ul', 'ol'):
+            self._close_paragraph()
+            self._lists.append([tag == 'ol', 0])
+            end = self._end_list
+        elif tag == 'li':
+            end = self._start_item(attrs.get('id'))
+        elif tag == 'pre':
+            self._close_paragraph()
+            self._pre = []
+            end = self._end_pre
+        elif tag == 'hr':
+            if not self._in_notes:
+                self._close_paragraph()
+                SubElement(self._container(), 'empty-line')
+        elif tag == 'br':
+            self._line_break()
+        elif tag == 'img':
+            image_attrs = {'l:href': image_href(attrs.get('src') or '')}
+            if attrs.get('alt'):
+                image_attrs['alt'] = attrs['alt']
+            self._start_inline('image', image_attrs)
+            self._end_inline()
+        elif tag == 'div' and attrs.get('class') == 'footnotes':
+            end = self._start_notes()
+        elif tag == 'sup' and attrs.get('class') == 'footnote-ref':
+            # <sup><a href="#fn-1">1</a></sup> is a single note link
+            self._in_note_ref = True
+            end = self._end_note_ref
+        elif tag == 'a':
+            end = self._start_link(attrs)
+        elif tag in INLINE_TAGS and self._pre is None:
+            self._start_inline(INLINE_TAGS[tag])
+            end = self._end_inline
+        if tag not in VOID_TAGS:
+            self._open.append((tag, end))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Close the matching element and the ones left open inside it, stray end tags are ignored
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                break
+        else:
+            return
+        while len(self._open) > index:
+            _, end = self._open.pop()
+            if end is not None:
+                end()
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._pre is not None:
+            self._pre.append(data)
+            return
+        if self._paragraph is None:
+            if not data.strip():
+                return
+            self._open_paragraph()
+        self._append_text(data)
+
+    def close(self):
+        super().close()
+        self._close_paragraph()
+
+    def _container(self):
+        """
+        Element the next block goes to, the untitled section is opened for the content before the first heading
+        """
+        if self._blocks:
+            return self._blocks[-1]
+        if not self._sections:
+            self._open_section(0)
+        return self._sections[-1][1]
+
+    def _open_section(self, level, section_id=None):
+        self._close_paragraph()
+        self._blocks.clear()
+        while self._sections and (self._sections[-1][0] >= level or self._sections[-1][0] == 0):
+            self._sections.pop()
+        parent = self._sections[-1][1] if self._sections else self._root
+        section = SubElement(parent, 'section', {'id': section_id} if section_id else {})
+        self._sections.append((level, section))
+        return section
+
+    def _start_heading(self, level, section_id):
+        section = self._open_section(level, section_id)
+        self._open_paragraph(SubElement(section, 'title'))
+        return self._close_paragraph
+
+    def _open_paragraph(self, parent=None):
+        parent = self._container() if parent is None else parent
+        self._paragraph = SubElement(parent, 'p')
+        self._paragraph_parent = parent
+        self._inline = [self._paragraph]
+        if self._prefix:
+            self._paragraph.text = self._prefix
+            self._prefix = None
+
+    def _close_paragraph(self):
+        paragraph = self._paragraph
+        if paragraph is None:
+            return
+        self._paragraph = None
+        self._inline = []
+        # Trim the whitespace around the text, it's the formatting of the HTML
+        if paragraph.text:
+            paragraph.text = paragraph.text.lstrip() or None
+        last = paragraph[-1] if len(paragraph) else None
+        if last is None:
+            if paragraph.text:
+                paragraph.text = paragraph.text.rstrip()
+        elif last.tail:
+            last.tail = last.tail.rstrip() or None
+
+        parent = self._paragraph_parent
+        if last is None and not paragraph.text:
+            parent.remove(paragraph)
+        elif (parent.tag == 'section' and not paragraph.text and len(paragraph) == 1
+              and last.tag == 'image' and not last.tail):
+            # An image on its own is a block image
+            parent.remove(paragraph)
+            parent.append(last)
+
+    def _start_inline(self, tag, attrs=None):
+        if self._paragraph is None:
+            self._open_paragraph()
+        self._inline.append(SubElement(self._inline[-1], tag, attrs or {}))
+
+    def _end_inline(self):
+        if len(self._inline) > 1:
+            self._inline.pop()
+
+    def _append_text(self, data):
+        elem = self._inline[-1]
+        if len(elem):
+            last = elem[-1]
+            last.tail = (last.tail or '') + data
+        else:
+            elem.text = (elem.text or '') + data
+
+    def _line_break(self):
+        # FB2 has no line breaks, a paragraph without inline markup is split instead
+        if self._paragraph is None:
+            return
+        if len(self._inline) == 1:
+            parent = self._paragraph_parent
+            self._close_paragraph()
+            self._open_paragraph(parent)
+        else:
+            self._append_text('\n')
+
+    def _start_quote(self):
+        self._close_paragraph()
+        if self._blocks:
+            # FB2 quotes don't nest, the inner one is merged into the outer one
+            self._blocks.append(self._blocks[-1])
+        else:
+            section = self._container()
+            at_start = all(child.tag in ('title', 'epigraph') for child in section)
+            self._blocks.append(SubElement(section, 'epigraph' if at_start else 'cite'))
+        return self._end_quote
+
+    def _end_quote(self):
+        self._close_paragraph()
+        if not self._blocks:
+            return
+        quote = self._blocks.pop()
+        if self._blocks and self._blocks[-1] is quote:
+            return
+        last = quote[-1] if len(quote) else None
+        if last is None or last.tag != 'p' or len(last) or not last.text:
+            return
+        match = TEXT_AUTHOR_PATTERN.search(last.text)
+        if match is None:
+            return
+        text = last.text[:match.start()].rstrip()
+        if text:
+            last.text = text
+        else:
+            quote.remove(last)
+        SubElement(quote, 'text-author').text = match.group(1)
+
+    def _end_list(self):
+        self._close_paragraph()
+        if self._lists:
+            self._lists.pop()
+
+    def _start_item(self, item_id):
+        self._close_paragraph()
+        if self._in_notes and item_id:
+            self._note_count += 1
+            section = self._open_section(1, item_id)
+            SubElement(SubElement(section, 'title'), 'p').text = str(self._note_count)
+            return None
+        if self._lists:
+            ordered_count = self._lists[-1]
+            ordered_count[1] += 1
+            self._prefix = f'{ordered_count[1]}. ' if ordered_count[0] else LIST_BULLET
+        return self._end_item
+
+    def _end_item(self):
+        self._close_paragraph()
+        self._prefix = None
+
+    def _end_pre(self):
+        lines = ''.join(self._pre).rstrip('\n').split('\n')
+        self._pre = None
+        container = self._container()
+        for line in lines:
+            if line.strip():
+                SubElement(SubElement(container, 'p'), 'code').text = line
+            else:
+                SubElement(container, 'empty-line')
+
+    def _start_link(self, attrs):
+        if attrs.get('class') == 'footnoteBackLink':
+            self._skip += 1
+            return self._end_skip
+        link_attrs = {'l:href': attrs['href']} if attrs.get('href') else {}
+        if self._in_note_ref:
+            link_attrs['type'] = 'note'
+        self._start_inline('a', link_attrs)
+        return self._end_inline
+
+    def _end_skip(self):
+        self._skip -= 1
+
+    def _end_note_ref(self):
+        self._in_note_ref = False
+
+    def _start_notes(self):
+        self._close_paragraph()
+        self._sections.clear()
+        self._blocks.clear()
+        self._lists.clear()
+        if self.notes is None:
+            self.notes = Element('body', {'name': 'notes'})
+            SubElement(SubElement(self.notes, 'title'), 'p').text = self.notes_title
+        self._root = self.notes
+        self._in_notes = True
+        return self._end_notes
+
+    def _end_notes(self):
+        self._close_paragraph()
+        self._sections.clear()
+        self._blocks.clear()
+        self._root = self.body
+        self._in_notes = False
+
+
+def markdown_to_fb2(text, body, notes_title='Notes'):
+    """
+    Convert a Markdown document to FB2 elements in one pass: markdown2 renders the whole document once
+    and MarkdownConverter turns the HTML tokens straight into elements of the body
+    :param text: Markdown document
+    :param body: main body Element, the sections are appended to it
+    :param notes_title: title of the notes body
+    :return: notes body Element with the footnotes, None if there are no footnotes
+    """
+    converter = MarkdownConverter(body, notes_title)
+    converter.feed(markdown2.markdown(text, extras=MARKDOWN_EXTRAS))
+    converter.close()
+    return converter.notes
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+
+from fictionbook.binaries import TAG_ATTRIBUTES, detect_encoding
+from fictionbook.sources import is_plain_file
+from fictionbook.text_engine import extract_text
+from fictionbook.text_store import ParagraphStore
+
+# Byte-level patterns for the section scan, the namespace prefix is optional
+ROOT_START_PATTERN = re.compile(rb'<(?![?!])([^\s/>]+)' + TAG_ATTRIBUTES + rb'>')
+STRUCTURE_TAG_PATTERN = re.compile(rb'<(/?)((?:[\w.-]+:)?(?:section|body))(?=[\s/>])' + TAG_ATTRIBUTES + rb'>')
+
+# Smallest byte range sent to a worker, smaller ones cost more in IPC than they save
+MIN_SLICE_SIZE = 1024 * 1024
+
+
+class BodyLayout:
+    """
+    Byte layout of the main body found by scan_body(): the root and body start tags,
+    the body content range and the top-level section ranges
+    """
+    __slots__ = ('root_tag', 'root_name', 'body_tag', 'body_name', 'content_start', 'content_end', 'sections')
+
+    def __init__(self, root_tag, root_name, body_tag, body_name, content_start, content_end, sections):
+        """
+        :param root_tag: raw <FictionBook ...> start tag, with the namespace declarations
+        :param root_name: qualified name of the root element
+        :param body_tag: raw <body ...> start tag
+        :param body_name: qualified name of the body element
+        :param content_start: offset of the body content, right after the start tag
+        :param content_end: offset of the closing </body> tag
+        :param sections: list of (start, end) byte ranges of the top-level sections
+        """
+        self.root_tag = root_tag
+        self.root_name = root_name
+        self.body_tag = body_tag
+        self.body_name = body_name
+        self.content_start = content_start
+        self.content_end = content_end
+        self.sections = sections
+
+
+def scan_body(data):
+    """
+    Find the main body and its top-level sections at the byte level, without parsing XML.
+    Only <section> and <body> tags are looked at, which can't appear in text, as '<' is always escaped there.
+    :param data: bytes or mmap of the book in an ASCII-compatible encoding
+    :return: BodyLayout
+    """
+    root_match = ROOT_START_PATTERN.search(data)
+    if root_match is None:
+        raise ValueError("Root element not found")
+    body_match = None
+    sections = []
+    depth = 0
+    for match in STRUCTURE_TAG_PATTERN.finditer(data, root_match.end()):
+        closing, name = match.group(1), match.group(2)
+        self_closing = match.group(0).endswith(b'/>')
+        if body_match is None:
+            if not closing and name.endswith(b'body') and not self_closing:
+                body_match = match
+            continue
+        if name.endswith(b'body'):
+            if closing and depth == 0:
+                return BodyLayout(root_match.group(0), root_match.group(1).decode('ascii'),
+                                  body_match.group(0), body_match.group(2).decode('ascii'),
+                                  body_match.end(), match.start(), sections)
+            continue
+        if self_closing:
+            if depth == 0:
+                sections.append((match.start(), match.end()))
+        elif not closing:
+            if depth == 0:
+                section_start = match.start()
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                sections.append((section_start, match.end()))
+    raise ValueError("Body not found")
+
+
+def split_body(layout, slice_size):
+    """
+    Cut the body content into byte ranges of about slice_size at top-level section boundaries,
+    so every range is a well-formed sequence of elements
+    :param layout: BodyLayout
+    :param slice_size: target size of a range in bytes
+    :return: list of (start, end) ranges covering the whole body content
+    """
+    ranges = []
+    start = layout.content_start
+    for _, section_end in layout.sections:
+        if section_end - start >= slice_size:
+            ranges.append((start, section_end))
+            start = section_end
+    if start < layout.content_end or not ranges:
+        ranges.append((start, layout.content_end))
+    return ranges
+
+
+def _extract_range(file_path, encoding, layout, start, end, compact):
+    """
+    Worker entry point: extract text of a byte range of the body, wrapped into the original
+    root and body start tags, so the namespace declarations are in place
+    :return: (paragraphs, chapters, characters, words)
+    """
+    with open(file_path, 'rb') as book_file:
+        book_file.seek(start)
+        content = book_file.read(end - start)
+    document = b''.join((
+        layout.root_tag, layout.body_tag, content,
+        f'</{layout.body_name}></{layout.root_name}>'.encode('ascii'),
+    ))
+    paragraphs, chapters = extract_text(document, compact=compact, encoding=encoding)
+    return (paragraphs, chapters) + _text_counts(paragraphs)
+
+
+def parse_parallel(file_path, workers=None, compact=False, slice_size=None):
+    """
+    Extract paragraphs and the chapter tree of a single large book across CPU cores.
+    Top-level sections of the main body are located with a byte scan, the body is cut into ranges
+    at section boundaries, ranges are parsed in a process pool and merged in document order.
+    The result is the same as of Fb2Reader.paragraphs and Fb2Reader.chapters.
+    Compressed books, books in UTF-16/32 (which the byte scan can't read) and books too small to split
+    are parsed in the current process.
+    :param file_path: path to the FB2 file (optionally compressed)
+    :param workers: number of worker processes, CPU count if None
+    :param compact: If true, return paragraphs as a ParagraphStore with style flags
+    :param slice_size: target size of a range in bytes, by default the body is cut into about
+    4 ranges per worker, but not smaller than MIN_SLICE_SIZE
+    :return: (paragraphs, chapters, stats), where stats is a dict with 'paragraphs', 'chapters',
+    'characters', 'words' and 'slices' counts
+    """
+    workers = workers or os.cpu_count() or 1
+    layout = None
+    if is_plain_file(file_path):
+        with open(file_path, 'rb') as book_file:
+            with mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                encoding = detect_encoding(data)
+                # UTF-16/32 byte order marks, such books can't be scanned as bytes
+                if data[:2] not in (b'\xff\xfe', b'\xfe\xff'):
+                    layout = scan_body(data)
+    if layout is None:
+        paragraphs, chapters = extract_text(file_path, compact=compact)
+        return paragraphs, chapters, _stats(paragraphs, chapters, *_text_counts(paragraphs), 1)
+
+    if slice_size is None:
+        slice_size = max((layout.content_end - layout.content_start) // (workers * 4), MIN_SLICE_SIZE)
+    ranges = split_body(layout, slice_size)
+
+    if workers == 1 or len(ranges) == 1:
+        results = [_extract_range(file_path, encoding, layout, start, end, compact) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            futures = [
+                executor.submit(_extract_range, file_path, encoding, layout, start, end, compact)
+                for start, end in ranges
+            ]
+            results = [future.result() for future in futures]
+
+    paragraphs = ParagraphStore(with_flags=True) if compact else []
+    chapters = []
+    characters = words = 0
+    for range_paragraphs, range_chapters, range_characters, range_words in results:
+        offset = len(paragraphs)
+        for top_chapter in range_chapters:
+            for chapter in top_chapter.walk():
+                chapter.start += offset
+                chapter.end += offset
+        paragraphs.extend(range_paragraphs)
+        chapters.extend(range_chapters)
+        characters += range_characters
+        words += range_words
+    return paragraphs, chapters, _stats(paragraphs, chapters, characters, words, len(ranges))
+
+
+def _text_counts(paragraphs):
+    """
+    :return: (characters, words) of the paragraphs
+    """
+    characters = words = 0
+    for paragraph in paragraphs:
+        characters += len(paragraph)
+        words += len(paragraph.split())
+    return characters, words
+
+
+def _stats(paragraphs, chapters, characters, words, slices):
+    return {
+        'paragraphs': len(paragraphs),
+        'chapters': sum(1 for top_chapter in chapters for _ in top_chapter.walk()),
+        'characters': characters,
+        'words': words,
+        'slices': slices,
+    }
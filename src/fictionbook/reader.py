@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
-import base64
-import urllib.request
-import xml.etree.ElementTree as et
+import mmap
+import shutil
+import asyncio
+import tempfile
+import functools
+import itertools
+
+from fictionbook.backends import get_backend
+from fictionbook.binaries import (CHUNK_SIZE, FB2_NAMESPACE, Fb2Binary, extract_binaries, find_binary,
+                                  scan_binaries)
+from fictionbook.chapters import build_text
+from fictionbook.downloads import ImageDownloader
+from fictionbook.index import Fb2Index
+from fictionbook.sources import is_plain_file, open_book
+from fictionbook.text_store import ParagraphStore
 
 
 class Fb2Reader:
@@ -10,61 +22,477 @@ class Fb2Reader:
     FictionBook2 reader
     """
 
-    def __init__(self, file_path: str, images_dir: str, download_images=False):
+    def __init__(self, file_path, images_dir: str, download_images=False, metadata_only=False,
+                 skip_binaries=False, downloader=None, image_store=None, compact=False, cache=None,
+                 backend=None):
         """
-        :param file_path:
+        :param file_path: path to .fb2, .fb2.zip or .fb2.gz file, bytes with the book content,
+        or a binary file object; compressed books are decompressed on the fly
         :param images_dir:
         :param download_images:
+        :param metadata_only: If true, stop parsing at the closing </description> tag,
+        so only metadata and cover are available, and nothing is written to images_dir
+        :param skip_binaries: If true, find <binary> elements at the byte level and feed only the rest
+        of the file to the XML parser; binaries are decoded from their byte offsets on demand.
+        Only applies to uncompressed files, other sources are parsed as usual
+        :param downloader: ImageDownloader used if download_images is true, share one across readers
+        to reuse its connections and cache; a default one without cache is used if None
+        :param image_store: ImageStore to decode images into instead of images_dir,
+        identical images of different books are stored once
+        :param compact: If true, keep paragraphs in a ParagraphStore with style flags
+        instead of a list of strings, which takes several times less memory for large books
+        :param cache: BookCache to restore the parsed book from, or to store it to after parsing.
+        A restored reader has no element tree (root and body are None), everything else works as usual.
+        Only uncompressed files are cached, and never if download_images is true
+        :param backend: XML parser backend: 'etree', 'lxml', 'auto' (lxml if installed, ElementTree otherwise),
+        or a backend instance, e.g. LxmlBackend(recover=True); ElementTree if None
         """
-        if not isinstance(file_path, str):
-            raise TypeError("file_path must be a string")
+        if not isinstance(file_path, (str, os.PathLike, bytes, bytearray)) and not hasattr(file_path, 'read'):
+            raise TypeError("file_path must be a path, bytes or a binary file object")
         if not isinstance(images_dir, str):
             raise TypeError("images_dir must be a string")
         self.file_path = file_path
         self.images_dir = images_dir
+        self.backend = get_backend(backend)
         self.root = None
         self.metadata = None
         self.body = None
         self.cover_image = None
-        if not os.path.isdir(self.images_dir):
-            os.mkdir(self.images_dir)
-        self._read(download_images)
+        self._paragraphs = None
+        self._chapters = None
+        self.compact = compact
+        self.binaries = {}
+        self.downloaded_images = []
+        self.image_store = image_store
+        self._extracted_images = {}
+        # Images being decoded by get_image_async(), binary id to future
+        self._image_tasks = {}
+        if metadata_only:
+            self._read_metadata()
+            return
+        # Readers in several processes may share images_dir
+        os.makedirs(self.images_dir, exist_ok=True)
+        use_cache = cache is not None and not download_images and is_plain_file(self.file_path)
+        if use_cache and self._restore(cache.load(self.file_path)):
+            return
+        self._read(download_images, skip_binaries, downloader)
+        if use_cache:
+            cache.store(self.file_path, self._snapshot())
 
     @property
     def cover(self):
-        return os.path.join(self.images_dir, self.cover_image) if self.cover_image else None
+        if not self.cover_image:
+            return None
+        if self.cover_image in self.binaries:
+            return self.get_image(self.cover_image)
+        return os.path.join(self.images_dir, self.cover_image)
 
     @property
     def images(self):
-        return [os.path.join(self.images_dir, image) for image in os.listdir(self.images_dir)]
+        """
+        Paths of all the book images, each binary is decoded on first access
+        :return: list of image paths
+        """
+        return [self.get_image(binary_id) for binary_id in self.binaries] + self.downloaded_images
+
+    def get_image(self, binary_id):
+        """
+        Decode the binary with the given id into images_dir, unless it has been decoded already
+        :param binary_id: 'id' attribute of the <binary> element, '#' prefix is trimmed
+        :return: path of the image file
+        """
+        if binary_id.startswith('#'):
+            binary_id = binary_id[1:]
+        if binary_id not in self._extracted_images:
+            binary = self.binaries.get(binary_id)
+            if binary is None:
+                raise KeyError(f"Binary {binary_id} not found")
+            self._extracted_images[binary_id] = self._save_image(binary)
+        return self._extracted_images[binary_id]
+
+    @classmethod
+    async def open(cls, file_path, images_dir, executor=None, **options):
+        """
+        Async constructor: parse the book in an executor, so the event loop is never blocked
+        :param file_path: see Fb2Reader
+        :param images_dir: see Fb2Reader
+        :param executor: concurrent.futures executor to parse the book in, the default thread pool
+        of the loop if None. With a ProcessPoolExecutor the parsed reader is pickled back,
+        so the arguments must be picklable and the default ElementTree backend is required
+        :param options: other Fb2Reader arguments
+        :return: Fb2Reader
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(cls, file_path, images_dir, **options))
+
+    async def get_image_async(self, binary_id, executor=None):
+        """
+        Async version of get_image(): decode and write the image in an executor.
+        Concurrent requests of the same image share a single decoding.
+        :param binary_id: 'id' attribute of the <binary> element, '#' prefix is trimmed
+        :param executor: thread pool executor, the default one of the loop if None
+        :return: path of the image file
+        """
+        if binary_id.startswith('#'):
+            binary_id = binary_id[1:]
+        if binary_id in self._extracted_images:
+            return self._extracted_images[binary_id]
+        task = self._image_tasks.get(binary_id)
+        if task is None:
+            binary = self.binaries.get(binary_id)
+            if binary is None:
+                raise KeyError(f"Binary {binary_id} not found")
+            loop = asyncio.get_running_loop()
+            task = self._image_tasks[binary_id] = loop.run_in_executor(executor, self._save_image, binary)
+            task.add_done_callback(lambda _: self._image_tasks.pop(binary_id, None))
+        # A cancelled waiter must not cancel the decoding shared with the others
+        image_path = await asyncio.shield(task)
+        self._extracted_images[binary_id] = image_path
+        return image_path
+
+    async def images_async(self, executor=None):
+        """
+        Async version of the images property, binaries are decoded concurrently in the executor
+        :param executor: thread pool executor, the default one of the loop if None
+        :return: list of image paths
+        """
+        image_paths = await asyncio.gather(*(self.get_image_async(binary_id, executor) for binary_id in self.binaries))
+        return list(image_paths) + self.downloaded_images
+
+    async def aiter_paragraphs(self, section=None, executor=None, batch_size=256):
+        """
+        Async version of iter_paragraphs(): paragraphs are collected in the executor batch by batch,
+        so neither a large book nor a slow consumer holds the event loop
+        :param section: see iter_paragraphs()
+        :param executor: thread pool executor, the default one of the loop if None
+        :param batch_size: number of paragraphs collected per executor call
+        :return: async generator of paragraphs
+        """
+        loop = asyncio.get_running_loop()
+        paragraphs = self.iter_paragraphs(section)
+        while True:
+            batch = await loop.run_in_executor(executor, list, itertools.islice(paragraphs, batch_size))
+            if not batch:
+                break
+            for paragraph in batch:
+                yield paragraph
 
     @property
     def paragraphs(self):
         """
         Collect all paragraphs from the body.
         Iterate body recursively and collect all paragraphs, including nested tags.
+        The list is computed once and cached.
+        :return: list of paragraphs, ParagraphStore in compact mode
+        """
+        if self._paragraphs is None:
+            self._build_text()
+        return self._paragraphs
+
+    @property
+    def chapters(self):
+        """
+        Chapter tree: top-level sections of the body as Fb2Chapter nodes,
+        with nested sections in their children. Paragraphs of a chapter are
+        reader.paragraphs[chapter.start:chapter.end].
+        :return: list of Fb2Chapter
+        """
+        if self._chapters is None:
+            self._build_text()
+        return self._chapters
+
+    def chapter_paragraphs(self, chapter):
+        """
+        Paragraphs of the chapter, nested chapters included
+        :param chapter: Fb2Chapter
         :return: list of paragraphs
         """
+        return self.paragraphs[chapter.start:chapter.end]
+
+    def _build_text(self):
+        """
+        Collect paragraphs and the chapter tree in a single pass over the body
+        """
+        paragraphs = ParagraphStore(with_flags=True) if self.compact else []
+        if self.body is None:
+            self._paragraphs, self._chapters = paragraphs, []
+            return
+        flags = paragraphs.flags if self.compact else None
+        self._paragraphs, self._chapters = build_text(self.body, paragraphs=paragraphs, flags=flags)
+
+    def iter_paragraphs(self, section=None):
+        """
+        Lazily yield paragraphs of the body in document order, without building a list,
+        so taking the first N paragraphs costs only N paragraphs.
+        :param section: start from this section: number of a top-level section,
+        or 'id' attribute of any section; the whole body if None
+        :return: generator of paragraphs
+        """
         if self.body is None:
-            return []
+            # Restored from the cache, navigate by the chapter tree
+            yield from self._iter_cached_paragraphs(section)
+            return
+        if section is None:
+            if self._paragraphs is not None:
+                yield from self._paragraphs
+                return
+            start = self.body
+        elif isinstance(section, str):
+            sections = self.body.iter(f'{FB2_NAMESPACE}section')
+            start = next((elem for elem in sections if elem.get('id') == section), None)
+            if start is None:
+                raise KeyError(f"Section {section} not found")
+        else:
+            start = self.body.findall(f'{FB2_NAMESPACE}section')[section]
 
-        paragraphs = []
-        for p in self.body.findall('.//{http://www.gribuser.ru/xml/fictionbook/2.0}p'):
-            text_content = ''.join(p.itertext())
+        started = start is self.body
+        for elem in self.body.iter():
+            if not started:
+                if elem is not start:
+                    continue
+                started = True
+            if elem.tag != f'{FB2_NAMESPACE}p':
+                continue
+            text_content = ''.join(elem.itertext())
             if text_content:
-                paragraphs.append(text_content.strip())
+                yield text_content.strip()
 
-        return paragraphs
+    def _iter_cached_paragraphs(self, section=None):
+        if self._paragraphs is None:
+            return
+        if section is None:
+            yield from self._paragraphs
+            return
+        if isinstance(section, str):
+            chapters = (chapter for top_chapter in self._chapters for chapter in top_chapter.walk())
+            start = next((chapter for chapter in chapters if chapter.id == section), None)
+            if start is None:
+                raise KeyError(f"Section {section} not found")
+        else:
+            start = self._chapters[section]
+        for index in range(start.start, len(self._paragraphs)):
+            yield self._paragraphs[index]
 
-    def _read(self, download_images=False):
-        tree = et.parse(self.file_path)
-        self.root = tree.getroot()
+    def _snapshot(self):
+        """
+        Parsed state of the book for BookCache, binaries are stored by their byte offsets
+        """
+        if any(binary.element is not None for binary in self.binaries.values()):
+            with open(self.file_path, 'rb') as book_file:
+                with mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    binaries = [binary for _, _, binary in scan_binaries(data) if binary.id and binary.length]
+        else:
+            binaries = self.binaries.values()
+        return {
+            'metadata': self.backend.to_etree(self.metadata),
+            'cover_image': self.cover_image,
+            'paragraphs': self.paragraphs,
+            'chapters': self.chapters,
+            'binaries': [(binary.id, binary.content_type, binary.offset, binary.length) for binary in binaries],
+        }
+
+    def _restore(self, snapshot):
+        """
+        Restore the parsed state from BookCache
+        :return: True if restored
+        """
+        if snapshot is None:
+            return False
+        paragraphs = snapshot['paragraphs']
+        if self.compact and not isinstance(paragraphs, ParagraphStore):
+            # Cached by a non-compact reader, without style flags; the book is parsed again
+            # and cached in compact form, which serves both kinds of readers
+            return False
+        if not self.compact and isinstance(paragraphs, ParagraphStore):
+            paragraphs = list(paragraphs)
+        self.metadata = snapshot['metadata']
+        self.cover_image = snapshot['cover_image']
+        self._chapters = snapshot['chapters']
+        self._paragraphs = paragraphs
+        for binary_id, content_type, offset, length in snapshot['binaries']:
+            self.binaries[binary_id] = Fb2Binary(binary_id, content_type, file_path=self.file_path,
+                                                 offset=offset, length=length)
+        return True
+
+    @staticmethod
+    def stream(file_path, backend=None):
+        """
+        Parse the book incrementally and yield its parts as soon as they are complete.
+        Every element is released right after it has been yielded (or skipped), so memory
+        stays flat no matter how big the file is. A yielded element is only valid
+        until the generator is resumed.
+        Yields (kind, element) tuples, where kind is one of:
+        * 'description' - the complete <description> element
+        * 'p' - a complete paragraph of the main body, including its inline markup
+        * 'section' - a section of the main body; its paragraphs have already been yielded
+          and released, so only the attributes (e.g. 'id') are left
+        <binary> elements and the extra bodies (e.g. notes) are dropped as they complete.
+        :param file_path: path to the FB2 file (optionally compressed), bytes or a binary file object
+        :param backend: XML parser backend, see Fb2Reader
+        """
+        with open_book(file_path) as source:
+            events = get_backend(backend).iterparse(source, events=('start', 'end'))
+            yield from Fb2Reader._stream_events(events)
+
+    @staticmethod
+    def _stream_events(events):
+        """
+        Turn ('start', 'end') iterparse events into the stream() parts, releasing processed elements
+        """
+        stack = []
+        body_count = 0
+        in_description = False
+        in_main_body = False
+        in_paragraph = 0
+        for event, elem in events:
+            if event == 'start':
+                stack.append(elem)
+                if len(stack) == 2:
+                    if elem.tag == f'{FB2_NAMESPACE}description':
+                        in_description = True
+                    elif elem.tag == f'{FB2_NAMESPACE}body':
+                        body_count += 1
+                        in_main_body = body_count == 1
+                elif elem.tag == f'{FB2_NAMESPACE}p' and not in_description:
+                    in_paragraph += 1
+                continue
+
+            stack.pop()
+            if not stack:
+                # The root element itself, everything has been released already
+                break
+            if len(stack) == 1 and elem.tag == f'{FB2_NAMESPACE}description':
+                in_description = False
+                yield 'description', elem
+            elif in_description:
+                # Metadata is small, keep it whole until the description is complete
+                continue
+            elif elem.tag == f'{FB2_NAMESPACE}p':
+                in_paragraph -= 1
+                if in_paragraph:
+                    continue
+                if in_main_body:
+                    yield 'p', elem
+            elif in_paragraph:
+                # Inline markup is released together with its paragraph
+                continue
+            elif in_main_body and elem.tag == f'{FB2_NAMESPACE}section':
+                yield 'section', elem
+            elif len(stack) == 1 and elem.tag == f'{FB2_NAMESPACE}body':
+                in_main_body = False
+
+            elem.clear()
+            stack[-1].remove(elem)
+
+    @staticmethod
+    def load_section(file_path, section, cache_dir=None):
+        """
+        Parse a single top-level section of the main body, without reading the rest of the book.
+        Uses the persistent byte-offset index, which is built on first use and rebuilt when the book changes.
+        :param file_path: path to the FB2 file
+        :param section: number of the section, or its 'id' attribute
+        :param cache_dir: directory to keep the index in, next to the book if None
+        :return: <section> Element
+        """
+        return Fb2Index.open(file_path, cache_dir).load_section(section)
+
+    @staticmethod
+    def extract_cover(file_path, images_dir, image_name=None):
+        """
+        Decode only the cover image, e.g. for thumbnails: the coverpage href is read from <description>,
+        and only the matching <binary> is decoded. The body is never parsed, other binaries are never decoded.
+        Uncompressed books are searched for the binary at the byte level, compressed ones are scanned by expat
+        without building the tree.
+        :param file_path: path to the FB2 file (optionally compressed)
+        :param images_dir: directory to write the cover to, created if missing
+        :param image_name: file name of the cover without extension, the binary id is used if None
+        :return: path of the cover image, None if the book has no cover
+        """
+        cover_image = Fb2Reader(file_path, images_dir, metadata_only=True).cover_image
+        if not cover_image:
+            return None
+        os.makedirs(images_dir, exist_ok=True)
+        if is_plain_file(file_path):
+            with open(file_path, 'rb') as book_file:
+                with mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    binary = find_binary(data, cover_image, file_path)
+            if binary is None:
+                raise KeyError(f"Binary {cover_image} not found")
+            image_path = os.path.join(images_dir, binary.file_name)
+            if image_name is not None:
+                image_path = os.path.join(images_dir, image_name + os.path.splitext(binary.file_name)[1])
+            binary.save(image_path)
+            return image_path
+
+        # Decode into a private directory, so concurrent extractions into images_dir never clash
+        temp_dir = tempfile.mkdtemp(dir=images_dir)
+        try:
+            extracted = extract_binaries(file_path, temp_dir, {cover_image})
+            if cover_image not in extracted:
+                raise KeyError(f"Binary {cover_image} not found")
+            file_name = os.path.basename(extracted[cover_image])
+            if image_name is not None:
+                file_name = image_name + os.path.splitext(file_name)[1]
+            image_path = os.path.join(images_dir, file_name)
+            os.replace(extracted[cover_image], image_path)
+        finally:
+            shutil.rmtree(temp_dir)
+        return image_path
+
+    def _read(self, download_images=False, skip_binaries=False, downloader=None):
+        skip_binaries = skip_binaries and is_plain_file(self.file_path)
+        if skip_binaries:
+            self._read_without_binaries()
+        else:
+            with open_book(self.file_path) as source:
+                self.root = self.backend.parse(source)
 
         self._extract_metadata()
         self._extract_body()
-        self._extract_binary()
+        if not skip_binaries:
+            self._extract_binary()
         if download_images:
-            self._download_images()
+            self._download_images(downloader)
+
+    def _read_without_binaries(self):
+        """
+        Memory-map the file, find <binary> spans by byte offset and feed only the ranges between them
+        to the parser. Found binaries make up the offset table of the binary index.
+        """
+        with open(self.file_path, 'rb') as book_file:
+            with mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                spans = scan_binaries(data, self.file_path)
+                parser = self.backend.feed_parser()
+                position = 0
+                for start, end, _ in spans + [(len(data), len(data), None)]:
+                    for chunk_start in range(position, start, CHUNK_SIZE):
+                        parser.feed(data[chunk_start:min(chunk_start + CHUNK_SIZE, start)])
+                    position = end
+                self.root = parser.close()
+        for _, _, binary in spans:
+            if binary.id and binary.length:
+                self.binaries[binary.id] = binary
+
+    def _read_metadata(self):
+        """
+        Parse the book incrementally up to the closing </description> tag.
+        Neither <body> nor <binary> elements are ever built.
+        """
+        depth = 0
+        with open_book(self.file_path) as source:
+            for event, elem in self.backend.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1:
+                        self.root = elem
+                    elif depth == 2 and elem.tag in (f'{FB2_NAMESPACE}body', f'{FB2_NAMESPACE}binary'):
+                        # <description> always precedes them, so it's missing
+                        break
+                    continue
+                depth -= 1
+                if depth == 1 and elem.tag == f'{FB2_NAMESPACE}description':
+                    break
+        self._extract_metadata()
 
     def _extract_metadata(self):
         """
@@ -85,7 +513,7 @@ class Fb2Reader:
 
     def _extract_binary(self):
         """
-        Extract all <binary> elements from root
+        Index all <binary> elements from root, nothing is decoded until an image is requested
         """
         binary_elements = self.root.findall('{http://www.gribuser.ru/xml/fictionbook/2.0}binary')
         for binary in binary_elements:
@@ -93,7 +521,7 @@ class Fb2Reader:
             binary_content = binary.text
             binary_content_type = binary.get('content-type')
             if binary_id and binary_content:
-                self._save_image(binary_content, binary_content_type, binary_id)
+                self.binaries[binary_id] = Fb2Binary(binary_id, binary_content_type, binary)
 
     def _extract_cover(self):
         """
@@ -115,7 +543,7 @@ class Fb2Reader:
             href = href[1:]
         return href
 
-    def _download_images(self):
+    def _download_images(self, downloader=None):
         """
         Download images from the book if <image l:href="http..."> tag is used
         and points to a URL on the internet
@@ -127,31 +555,21 @@ class Fb2Reader:
             href_attr = image_elem.get('{http://www.w3.org/1999/xlink}href', '')
             if href_attr.startswith("http"):
                 images.add(href_attr)
+        if not images:
+            return
         # Download images
-        for image_url in images:
-            self._download_image(image_url)
-
-    def _download_image(self, image_url):
-        try:
-            with urllib.request.urlopen(image_url) as response:
-                if response.code == 200:
-                    image_name = os.path.basename(image_url)
-                    image_path = os.path.join(self.images_dir, image_name)
-
-                    with open(image_path, 'wb') as image_file:
-                        image_file.write(response.read())
-        except urllib.error.URLError as e:
-            print(f"Error downloading image from {image_url}: {e}")
-
-    def _save_image(self, image_data, content_type, image_id):
-        image_extension = content_type.split("/")[-1]
-        image_name, ext = os.path.splitext(image_id)
-
-        if not ext:
-            ext = f".{image_extension.lower()}"
-
-        image_path = os.path.abspath(os.path.join(self.images_dir, image_name + ext))
+        if downloader is None:
+            with ImageDownloader() as downloader:
+                downloaded = downloader.download(sorted(images), self.images_dir)
+        else:
+            downloaded = downloader.download(sorted(images), self.images_dir)
+        self.downloaded_images.extend(downloaded.values())
 
-        with open(image_path, 'wb') as image_file:
-            image_file.write(base64.b64decode(image_data))
+    def _save_image(self, binary):
+        if self.image_store is not None:
+            _, image_path = self.image_store.put_binary(binary)
+            return image_path
+        image_path = os.path.join(self.images_dir, binary.file_name)
+        binary.save(image_path)
+        return image_path
 
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import gzip
+import zipfile
+import contextlib
+
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def is_plain_file(source):
+    """
+    Check if the source is a path to an uncompressed book, which can be memory-mapped or read by offsets
+    :param source: path, bytes or binary file object
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        return False
+    with open(source, 'rb') as book_file:
+        magic = book_file.read(4)
+    return not magic.startswith(ZIP_MAGIC) and not magic.startswith(GZIP_MAGIC)
+
+
+def _peek_magic(file_object):
+    """
+    Read the first bytes of the file object without consuming them, if possible
+    """
+    if hasattr(file_object, 'peek'):
+        return file_object.peek(4)[:4]
+    if file_object.seekable():
+        position = file_object.tell()
+        magic = file_object.read(4)
+        file_object.seek(position)
+        return magic
+    return b''
+
+
+def _open_zip_member(archive):
+    """
+    Open the first .fb2 member of the archive, or the first file if there's no such member
+    """
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    fb2_members = [info for info in members if info.filename.lower().endswith('.fb2')]
+    if not fb2_members and not members:
+        raise ValueError("No FB2 file found in the archive")
+    return archive.open((fb2_members or members)[0])
+
+
+@contextlib.contextmanager
+def open_book(source):
+    """
+    Open the book source as a binary file object, .fb2.zip and .fb2.gz are decompressed on the fly
+    without temporary files. Compression is detected by the content, not by the extension.
+    File objects passed by the caller are not closed.
+    :param source: path to the book, bytes with the book content, or a binary file object
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            file_object = io.BytesIO(source)
+        elif isinstance(source, (str, os.PathLike)):
+            file_object = stack.enter_context(open(source, 'rb'))
+        elif hasattr(source, 'read'):
+            file_object = source
+        else:
+            raise TypeError("book source must be a path, bytes or a binary file object")
+
+        magic = _peek_magic(file_object)
+        if magic.startswith(ZIP_MAGIC):
+            archive = stack.enter_context(zipfile.ZipFile(file_object))
+            file_object = stack.enter_context(_open_zip_member(archive))
+        elif magic.startswith(GZIP_MAGIC):
+            file_object = stack.enter_context(gzip.GzipFile(fileobj=file_object, mode='rb'))
+        yield file_object
+
+
+class _ZipMemberOutput:
+    """
+    Writable member of a new zip archive, closing it closes the archive too
+    """
+
+    def __init__(self, file_name, member_name, compresslevel=None):
+        self._archive = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        try:
+            self._member = self._archive.open(member_name, 'w', force_zip64=True)
+        except BaseException:
+            self._archive.close()
+            raise
+
+    def write(self, data):
+        return self._member.write(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return self._member.closed
+
+    def close(self):
+        if not self._member.closed:
+            try:
+                self._member.close()
+            finally:
+                self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def output_compression(file_name):
+    """
+    Compression of the output file by its extension
+    :param file_name: path of the book
+    :return: 'zip', 'gzip' or None
+    """
+    lower_name = os.fspath(file_name).lower()
+    if lower_name.endswith('.zip'):
+        return 'zip'
+    if lower_name.endswith('.gz'):
+        return 'gzip'
+    return None
+
+
+def open_output(file_name, compression=None, compresslevel=None):
+    """
+    Open the book file for writing as a binary file object; .fb2.zip and .fb2.gz books are compressed
+    on the fly as the data is written, without temporary files
+    :param file_name: path of the book
+    :param compression: 'zip', 'gzip', or None to choose by the extension of file_name
+    :param compresslevel: compression level from 0 to 9, the default one of the compressor if None
+    :return: binary file object, to be closed by the caller
+    """
+    compression = compression or output_compression(file_name)
+    if compression == 'zip':
+        member_name = os.path.basename(os.fspath(file_name))
+        if member_name.lower().endswith('.zip'):
+            member_name = member_name[:-len('.zip')]
+        if not member_name.lower().endswith('.fb2'):
+            member_name += '.fb2'
+        return _ZipMemberOutput(file_name, member_name, compresslevel)
+    if compression == 'gzip':
+        return gzip.open(file_name, 'wb', compresslevel=9 if compresslevel is None else compresslevel)
+    if compression is not None:
+        raise ValueError(f"Unsupported compression {compression}")
+    return open(file_name, 'wb')
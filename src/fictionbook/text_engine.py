@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import xml.parsers.expat
+
+from fictionbook.binaries import CHUNK_SIZE, EXPAT_FB2_NAMESPACE, EXPAT_NAMESPACE_SEPARATOR
+from fictionbook.chapters import Fb2Chapter
+from fictionbook.sources import open_book
+from fictionbook.text_store import (FLAG_ANNOTATION, FLAG_CITE, FLAG_EPIGRAPH, FLAG_POEM, FLAG_TITLE,
+                                    ParagraphStore)
+
+# Style flags of the paragraphs inside these elements, expat names
+EXPAT_STYLE_FLAGS = {
+    f'{EXPAT_FB2_NAMESPACE}title': FLAG_TITLE,
+    f'{EXPAT_FB2_NAMESPACE}epigraph': FLAG_EPIGRAPH,
+    f'{EXPAT_FB2_NAMESPACE}cite': FLAG_CITE,
+    f'{EXPAT_FB2_NAMESPACE}poem': FLAG_POEM,
+    f'{EXPAT_FB2_NAMESPACE}annotation': FLAG_ANNOTATION,
+}
+
+_BODY = f'{EXPAT_FB2_NAMESPACE}body'
+_SECTION = f'{EXPAT_FB2_NAMESPACE}section'
+_TITLE = f'{EXPAT_FB2_NAMESPACE}title'
+_TEXT_ELEMENTS = {
+    f'{EXPAT_FB2_NAMESPACE}p': 'p',
+    f'{EXPAT_FB2_NAMESPACE}v': 'verse',
+}
+
+
+class TextExtractor:
+    """
+    Plain text extraction on raw expat callbacks: no element tree is built, and parsing stops
+    at the end of the main body, so <binary> elements are never even read.
+    Paragraph text and chapter ranges are exactly those of Fb2Reader.paragraphs and Fb2Reader.chapters.
+    Most of the time goes to expat calling back into Python for every element, inline markup included,
+    so the engine is only 1.1-1.3x faster than Fb2Reader with the etree backend, see src/examples/benchmark_parsers.py.
+    Collected events are (kind, value, flags) tuples, where kind is one of:
+    * 'section_start' - Fb2Chapter of a section, its title is set once the 'title' event comes
+    * 'title' - plain text of the section title
+    * 'p' - paragraph text
+    * 'verse' - text of a poem verse (<v>); verses are not paragraphs, the same way as in Fb2Reader
+    * 'section_end' - Fb2Chapter of the section, complete
+    flags are FLAG_* style bits of paragraphs and verses, 0 for other events.
+    """
+
+    def __init__(self, encoding=None):
+        """
+        :param encoding: encoding of the document, overrides the XML declaration
+        """
+        self.events = []
+        self.chapters = []
+        self.paragraph_count = 0
+        self.done = False
+        self._depth = 0
+        self._body_count = 0
+        self._in_main_body = False
+        # (tag, style) of the open elements of the main body
+        self._stack = []
+        self._sections = []
+        # Whether the title of every open section has been seen
+        self._titled = []
+        # Open paragraphs and verses: (kind, slot, text parts, flags); their events are kept in
+        # _pending in the order they start, until the outermost one is closed
+        self._texts = []
+        self._pending = []
+        # Depth of inline markup inside the innermost paragraph, which needs no bookkeeping
+        self._inline = 0
+        self._saved_inline = []
+        self._title = None
+        self._title_depth = None
+        self.parser = xml.parsers.expat.ParserCreate(encoding, namespace_separator=EXPAT_NAMESPACE_SEPARATOR)
+        self.parser.buffer_text = True
+        self.parser.buffer_size = CHUNK_SIZE
+        self.parser.StartElementHandler = self._start_element
+        self.parser.EndElementHandler = self._end_element
+        # Character data is only wanted inside paragraphs and titles, see _set_data_handler()
+        self.parser.CharacterDataHandler = None
+
+    def feed(self, data, final=False):
+        """
+        :param data: next chunk of the book, bytes
+        :param final: If true, this is the last chunk
+        """
+        self.parser.Parse(data, final)
+
+    def _start_element(self, name, attrs):
+        if self._texts and name not in _TEXT_ELEMENTS and name != _SECTION:
+            # Fast path for <emphasis>, <strong>, <a> and alike
+            self._inline += 1
+            return
+        self._saved_inline.append(self._inline)
+        self._inline = 0
+        self._depth += 1
+        if not self._in_main_body:
+            if self._depth == 2 and name == _BODY and not self.done:
+                self._body_count += 1
+                self._in_main_body = self._body_count == 1
+                self._stack.append((name, 0))
+            return
+
+        parent_tag, style = self._stack[-1]
+        if name == _SECTION:
+            chapter = Fb2Chapter(None, attrs.get('id'), len(self._sections), self.paragraph_count)
+            (self._sections[-1].children if self._sections else self.chapters).append(chapter)
+            self._sections.append(chapter)
+            self._titled.append(False)
+            self.events.append(('section_start', chapter, 0))
+            self._stack.append((name, 0))
+            return
+
+        if self._title is not None and self._depth == self._title_depth + 1:
+            self._title.append([])
+        elif name == _TITLE and parent_tag == _SECTION and not self._titled[-1]:
+            # Only the first title of the section counts
+            self._titled[-1] = True
+            self._title = []
+            self._title_depth = self._depth
+
+        kind = _TEXT_ELEMENTS.get(name)
+        if kind is not None:
+            self._pending.append(None)
+            self._texts.append((kind, len(self._pending) - 1, [], style))
+        self._stack.append((name, style | EXPAT_STYLE_FLAGS.get(name, 0)))
+        self._set_data_handler()
+
+    def _end_element(self, name):
+        if self._inline:
+            self._inline -= 1
+            return
+        self._inline = self._saved_inline.pop()
+        self._depth -= 1
+        if not self._in_main_body:
+            return
+        self._stack.pop()
+        if not self._stack:
+            # End of the main body, the rest of the book is of no interest
+            self._in_main_body = False
+            self.done = True
+            self.parser.CharacterDataHandler = None
+            return
+
+        if name == _SECTION:
+            chapter = self._sections.pop()
+            chapter.end = self.paragraph_count
+            self._titled.pop()
+            self.events.append(('section_end', chapter, 0))
+            return
+
+        if name in _TEXT_ELEMENTS:
+            kind, slot, parts, flags = self._texts.pop()
+            text = ''.join(parts)
+            if text:
+                self._pending[slot] = (kind, text.strip(), flags)
+            if not self._texts:
+                for event in self._pending:
+                    if event is not None:
+                        self.events.append(event)
+                        if event[0] == 'p':
+                            self.paragraph_count += 1
+                self._pending = []
+
+        if self._title is not None and name == _TITLE and self._depth == self._title_depth - 1:
+            title = ' '.join(' '.join(''.join(parts).split()) for parts in self._title) or None
+            self._sections[-1].title = title
+            self._title = None
+            if title is not None:
+                self.events.append(('title', title, FLAG_TITLE))
+        self._set_data_handler()
+
+    def _set_data_handler(self):
+        """
+        Route character data: straight into the text parts of the paragraph if it's the only
+        text being collected, which saves a Python call per text node; through _character_data()
+        if there are nested paragraphs or a title; nowhere otherwise
+        """
+        if self._title is not None or len(self._texts) > 1:
+            self.parser.CharacterDataHandler = self._character_data
+        elif self._texts:
+            self.parser.CharacterDataHandler = self._texts[0][2].append
+        else:
+            self.parser.CharacterDataHandler = None
+
+    def _character_data(self, data):
+        for _, _, parts, _ in self._texts:
+            parts.append(data)
+        if self._title and self._depth > self._title_depth:
+            self._title[-1].append(data)
+
+
+def iter_text_events(source, encoding=None):
+    """
+    Parse the book with TextExtractor and yield its events as they come,
+    see TextExtractor for the event kinds
+    :param source: path to the FB2 file (optionally compressed), bytes or a binary file object
+    :param encoding: encoding of the book, overrides the XML declaration
+    :return: generator of (kind, value, flags)
+    """
+    extractor = TextExtractor(encoding)
+    with open_book(source) as book_file:
+        while not extractor.done:
+            chunk = book_file.read(CHUNK_SIZE)
+            extractor.feed(chunk, not chunk)
+            yield from extractor.events
+            extractor.events.clear()
+            if not chunk:
+                break
+
+
+def extract_text(source, compact=False, encoding=None):
+    """
+    Paragraphs and chapter tree of the main body, exactly as Fb2Reader.paragraphs and Fb2Reader.chapters,
+    without building the element tree
+    :param source: path to the FB2 file (optionally compressed), bytes or a binary file object
+    :param compact: If true, return paragraphs as a ParagraphStore with style flags
+    :param encoding: encoding of the book, overrides the XML declaration
+    :return: (paragraphs, chapters)
+    """
+    paragraphs = ParagraphStore(with_flags=True) if compact else []
+    chapters = []
+    for kind, value, flags in iter_text_events(source, encoding):
+        if kind == 'p':
+            paragraphs.append(value)
+            if compact:
+                paragraphs.flags.append(flags)
+        elif kind == 'section_start' and value.depth == 0:
+            chapters.append(value)
+    return paragraphs, chapters
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import sys
+import mmap
+import struct
+from array import array
+from collections.abc import Sequence
+
+# Paragraph style flags, set from the enclosing elements of the paragraph
+FLAG_TITLE = 1
+FLAG_EPIGRAPH = 2
+FLAG_CITE = 4
+FLAG_POEM = 8
+FLAG_ANNOTATION = 16
+
+# File layout: header, little-endian uint32 offsets, flags (if any), UTF-8 text buffer
+STORE_MAGIC = b'FB2P'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sHHIQ')
+
+
+class ParagraphStore(Sequence):
+    """
+    Compact paragraph storage: one UTF-8 text buffer and an array('I') of paragraph offsets,
+    instead of a Python str object per paragraph. Optional per-paragraph style flags (FLAG_* bits)
+    are kept in an array('B'). Paragraphs are decoded on access; the store is picklable,
+    and can be saved to a file and memory-mapped back.
+    """
+
+    def __init__(self, with_flags=False):
+        """
+        :param with_flags: If true, keep style flags of every paragraph
+        """
+        self.buffer = bytearray()
+        self.offsets = array('I', [0])
+        self.flags = array('B') if with_flags else None
+        self._mmap = None
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs, flags=None):
+        """
+        :param paragraphs: iterable of str
+        :param flags: iterable of style flags, one per paragraph
+        :return: ParagraphStore
+        """
+        store = cls(with_flags=flags is not None)
+        for paragraph in paragraphs:
+            store.append(paragraph)
+        if flags is not None:
+            store.flags.extend(flags)
+        return store
+
+    def append(self, paragraph):
+        """
+        Add a paragraph to the end of the store; style flags, if kept, are appended to store.flags separately
+        :param paragraph: str
+        """
+        self.buffer += paragraph.encode('utf-8')
+        self.offsets.append(len(self.buffer))
+
+    def extend(self, paragraphs):
+        """
+        Add paragraphs to the end of the store; another ParagraphStore is appended
+        as raw buffers. If this store keeps flags, paragraphs without flags get 0
+        :param paragraphs: ParagraphStore or iterable of str
+        """
+        count = len(self)
+        if not isinstance(paragraphs, ParagraphStore):
+            for paragraph in paragraphs:
+                self.append(paragraph)
+        else:
+            base = len(self.buffer)
+            self.buffer += paragraphs.buffer
+            self.offsets.extend(offset + base for offset in paragraphs.offsets[1:])
+        if self.flags is not None:
+            if isinstance(paragraphs, ParagraphStore) and paragraphs.flags is not None:
+                self.flags.extend(paragraphs.flags)
+            else:
+                self.flags.extend(bytes(len(self) - count))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._paragraph(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("paragraph index out of range")
+        return self._paragraph(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._paragraph(i)
+
+    def _paragraph(self, index):
+        return bytes(self.buffer[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def flag(self, index):
+        """
+        Style flags of the paragraph, 0 if flags are not kept
+        """
+        return self.flags[index] if self.flags is not None else 0
+
+    @property
+    def nbytes(self):
+        """
+        Size of the stored data in bytes
+        """
+        flags_size = len(self.flags) * self.flags.itemsize if self.flags is not None else 0
+        return len(self.buffer) + len(self.offsets) * self.offsets.itemsize + flags_size
+
+    def __getstate__(self):
+        flags = self.flags.tobytes() if self.flags is not None else None
+        return bytes(self.buffer), self.offsets.tobytes(), flags
+
+    def __setstate__(self, state):
+        buffer, offsets, flags = state
+        self.buffer = bytearray(buffer)
+        self.offsets = array('I')
+        self.offsets.frombytes(offsets)
+        self.flags = None
+        if flags is not None:
+            self.flags = array('B')
+            self.flags.frombytes(flags)
+        self._mmap = None
+
+    def save(self, file_path):
+        """
+        Write the store to a file, which can be memory-mapped back with ParagraphStore.load()
+        :param file_path: path to the store file
+        """
+        offsets = array('I', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        with open(file_path, 'wb') as store_file:
+            store_file.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, int(self.flags is not None),
+                                               len(self), len(self.buffer)))
+            store_file.write(offsets.tobytes())
+            if self.flags is not None:
+                store_file.write(self.flags.tobytes())
+            store_file.write(self.buffer)
+
+    @classmethod
+    def load(cls, file_path, use_mmap=True):
+        """
+        Load the store saved with save()
+        :param file_path: path to the store file
+        :param use_mmap: If true, memory-map the file instead of reading it, so the text
+        is paged in by the OS on access and shared between processes
+        :return: ParagraphStore
+        """
+        with open(file_path, 'rb') as store_file:
+            if use_mmap:
+                data = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = store_file.read()
+        magic, version, has_flags, count, buffer_size = STORE_HEADER.unpack_from(data)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{file_path} is not a paragraph store")
+
+        position = STORE_HEADER.size
+        offsets_size = (count + 1) * 4
+        store = cls()
+        if sys.byteorder == 'little':
+            store.offsets = memoryview(data)[position:position + offsets_size].cast('I')
+        else:
+            store.offsets = array('I')
+            store.offsets.frombytes(data[position:position + offsets_size])
+            store.offsets.byteswap()
+        position += offsets_size
+        if has_flags:
+            store.flags = memoryview(data)[position:position + count].cast('B')
+            position += count
+        store.buffer = memoryview(data)[position:position + buffer_size]
+        store._mmap = data if use_mmap else None
+        return store
+
+    def close(self):
+        """
+        Release the memory-mapped file of a loaded store
+        """
+        if self._mmap is not None:
+            for view in (self.offsets, self.flags, self.buffer):
+                if isinstance(view, memoryview):
+                    view.release()
+            self._mmap.close()
+            self._mmap = None
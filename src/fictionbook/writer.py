@@ -2,10 +2,125 @@
 import os
 import json
 import base64
+import shutil
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import XMLGenerator, quoteattr
 from xml.etree.ElementTree import Element, SubElement
 from xml.etree.ElementTree import ElementTree as et
 
-import markdown2
+from fictionbook.binaries import BASE64_LINE_BYTES, FB2_NAMESPACE, XLINK_NAMESPACE, iter_base64_lines
+from fictionbook.markdown_converter import markdown_to_fb2
+from fictionbook.sources import open_book, open_output
+
+# Attributes of the root element
+ROOT_ATTRIBUTES = {
+    "xmlns": "http://www.gribuser.ru/xml/fictionbook/2.0",
+    "xmlns:l": "http://www.w3.org/1999/xlink"
+}
+
+# Elements of text with inline markup
+TEXT_TAGS = ('p', 'v', 'subtitle', 'text-author', 'th', 'td')
+
+# Image files embedded as binaries
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif')
+
+# Images up to this size are encoded in parallel, larger ones are streamed chunk by chunk
+PARALLEL_IMAGE_SIZE = 4 * 1024 * 1024
+# Total size of the base64 text encoded ahead of the output in parallel
+ENCODE_AHEAD_SIZE = 8 * 1024 * 1024
+
+
+def _encode_image(image_path):
+    """
+    Thread pool task: encode the image to line-wrapped base64 chunk by chunk,
+    so only the encoded text is held in memory
+    :return: bytearray
+    """
+    encoded = bytearray()
+    with open(image_path, 'rb') as image_file:
+        for chunk in iter_base64_lines(image_file):
+            encoded += chunk
+    return encoded
+
+
+def _encoded_size(size):
+    """
+    :return: size of the line-wrapped base64 text of size bytes
+    """
+    lines = -(-size // BASE64_LINE_BYTES)
+    return -(-size // 3) * 4 + lines
+
+
+def qualified_name(name):
+    """
+    Map a name in Clark notation, as of the elements parsed by ElementTree, to the prefixes declared
+    on the root: FB2 names go to the default namespace, xlink ones to 'l:'
+    :param name: tag or attribute name
+    :return: qualified name
+    """
+    if not name.startswith('{'):
+        return name
+    if name.startswith(FB2_NAMESPACE):
+        return name[len(FB2_NAMESPACE):]
+    if name.startswith(XLINK_NAMESPACE):
+        return 'l:' + name[len(XLINK_NAMESPACE):]
+    raise ValueError(f"Unsupported namespace of {name}")
+
+
+def qualified_attributes(attrib):
+    """
+    :param attrib: attributes of an element, names may be in Clark notation
+    :return: dict of attributes with qualified names, see qualified_name()
+    """
+    return {qualified_name(name): value for name, value in attrib.items()}
+
+
+def is_mixed_content(elem):
+    """
+    Check if the element has text content, which must be written as is, without indentation
+    """
+    if len(elem) == 0 or elem.tag.rpartition('}')[2] in TEXT_TAGS or (elem.text and elem.text.strip()):
+        return True
+    return any(child.tail and child.tail.strip() for child in elem)
+
+
+def dict_to_element(parent, data):
+    """
+    Recursively convert a dictionary to XML elements, see Fb2Writer
+    :param parent: parent Element
+    :param data: dictionary
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, dict):
+                child = SubElement(parent, key)
+                dict_to_element(child, value)
+            elif isinstance(value, list):
+                for item in value:
+                    child = SubElement(parent, key)
+                    dict_to_element(child, item)
+            else:
+                child = SubElement(parent, key)
+                child.text = str(value)
+    elif isinstance(data, list):
+        for item in data:
+            dict_to_element(parent, item)
+    else:
+        parent.text = str(data)
+
+
+def check_metadata(metadata):
+    """
+    Check for required elements in title-info
+    :param metadata: dict
+    """
+    assert isinstance(metadata, dict), "metadata must be a dictionary"
+    assert len(metadata) > 0, "metadata must not be empty"
+
+    title_info_data = metadata.get("title-info", {})
+    if "book-title" not in title_info_data or "author" not in title_info_data:
+        raise ValueError("Both 'book-title' and 'author' are required in title-info")
 
 
 class Fb2Writer:
@@ -31,10 +146,7 @@ class Fb2Writer:
         self.cover_image = None
 
         # Create root element
-        self.root = Element("FictionBook", attrib={
-            "xmlns": "http://www.gribuser.ru/xml/fictionbook/2.0",
-            "xmlns:l": "http://www.w3.org/1999/xlink"
-        })
+        self.root = Element("FictionBook", attrib=ROOT_ATTRIBUTES)
         # Create 'description' and 'body' elements
         self.description_elem = SubElement(self.root, "description")
         self.body_elem = SubElement(self.root, "body")
@@ -45,40 +157,18 @@ class Fb2Writer:
         :param parent: parent Element
         :param data: dictionary
         """
-        if isinstance(data, dict):
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    child = SubElement(parent, key)
-                    self.dict_to_element(child, value)
-                elif isinstance(value, list):
-                    for item in value:
-                        child = SubElement(parent, key)
-                        self.dict_to_element(child, item)
-                else:
-                    child = SubElement(parent, key)
-                    child.text = str(value)
-        elif isinstance(data, list):
-            for item in data:
-                self.dict_to_element(parent, item)
-        else:
-            parent.text = str(data)
+        dict_to_element(parent, data)
 
     def set_metadata(self, metadata):
         """
         Check for required elements in title-info and set metadata
         :param metadata:
         """
-        assert isinstance(metadata, dict), "metadata must be a dictionary"
-        assert len(metadata) > 0, "metadata must not be empty"
-
-        title_info_data = metadata.get("title-info", {})
-        if "book-title" not in title_info_data or "author" not in title_info_data:
-            raise ValueError("Both 'book-title' and 'author' are required in title-info")
-
+        check_metadata(metadata)
         self.metadata = self.description_elem  # for clarity
         self.dict_to_element(self.metadata, metadata)
 
-    def set_paragraphs(self, paragraphs, content_type):
+    def set_paragraphs(self, paragraphs, content_type='plaintext'):
         """
         Wraps the specific paragraph setting methods.
         :param paragraphs: list of paragraphs to set
@@ -93,18 +183,6 @@ class Fb2Writer:
         else:
             raise ValueError("Unsupported content type")
 
-    def _convert_html_to_fb2(self, html_content):
-        """
-        Helper method to convert HTML content (derived from Markdown) to FB2 tags.
-        """
-        # This is a simplified example. Ideally, you would use an HTML parser.
-        html_content = html_content.replace("<em>", f'<emphasis>')
-        html_content = html_content.replace("</em>", f'</emphasis>')
-        html_content = html_content.replace("<strong>", f'<strong>')
-        html_content = html_content.replace("</strong>", f'</strong>')
-        # Add other conversions as needed
-        return html_content
-
     def _set_paragraphs_plaintext(self, paragraphs):
         """
         Set the book body from a list of paragraphs
@@ -114,18 +192,7 @@ class Fb2Writer:
         assert len(paragraphs) > 0, "paragraphs must not be empty"
 
         self.body = self.body_elem
-
-        # Get book title from metadata
-        book_title_elem = self.metadata.find(".//book-title")
-        if book_title_elem is not None:
-            book_title = book_title_elem.text
-        else:
-            book_title = ""
-
-        # Add a title to body
-        title_elem = SubElement(self.body, "title")
-        p_elem = SubElement(title_elem, "p")
-        p_elem.text = book_title
+        self._set_body_title()
 
         # Add 'section' element
         section_elem = SubElement(self.body, "section")
@@ -146,14 +213,32 @@ class Fb2Writer:
 
     def _set_paragraphs_markdown(self, paragraphs):
         """
-        Converts markdown content to FB2 tags, e.g., *text* to <emphasis>text</emphasis>,
-        **text** to <strong>text</strong>, and so on.
+        Converts markdown content to FB2 elements in one pass, e.g., *text* to <emphasis>text</emphasis>,
+        **text** to <strong>text</strong>, headings to sections, footnotes to the notes body,
+        see MarkdownConverter
+        :param paragraphs: Markdown document, or list of its paragraphs
         """
-        md_parser = markdown2.Markdown(extras=["footnotes"])
-        for paragraph in paragraphs:
-            html_content = md_parser.convert(paragraph)
-            p = et.SubElement(self.body, 'p')
-            p.text = self._convert_html_to_fb2(html_content)
+        if isinstance(paragraphs, list):
+            paragraphs = '\n\n'.join(paragraphs)
+        self.body = self.body_elem
+        self._set_body_title()
+        notes = markdown_to_fb2(paragraphs, self.body)
+        if notes is not None:
+            self.root.append(notes)
+
+    def _set_body_title(self):
+        """
+        Add the book title from metadata as the body title
+        """
+        book_title_elem = self.metadata.find(".//book-title") if self.metadata is not None else None
+        if book_title_elem is not None:
+            book_title = book_title_elem.text
+        else:
+            book_title = ""
+
+        title_elem = SubElement(self.body, "title")
+        p_elem = SubElement(title_elem, "p")
+        p_elem.text = book_title
 
     def _set_paragraphs_xml(self, paragraphs):
         """
@@ -171,9 +256,22 @@ class Fb2Writer:
         self.body_elem.clear()
         self.dict_to_element(self.body_elem, body)
 
+    def stream(self, pretty_xml=True, compression=None, compresslevel=None):
+        """
+        Streaming mode: write the book to self.file_name part by part as it's generated,
+        without building the tree, see Fb2StreamWriter
+        :param pretty_xml: If true, indent the XML
+        :param compression: see write()
+        :param compresslevel: see write()
+        :return: Fb2StreamWriter
+        """
+        return Fb2StreamWriter(self.file_name, self.images_dir, pretty_xml=pretty_xml,
+                               compression=compression, compresslevel=compresslevel)
+
     def indent(self, elem, level=0):
         i = "\n" + level*"  "
-        if len(elem):
+        # Text with inline markup is kept as is, indentation would change it
+        if len(elem) and not is_mixed_content(elem):
             if not elem.text or not elem.text.strip():
                 elem.text = i + "  "
             for child in elem:
@@ -184,13 +282,22 @@ class Fb2Writer:
             if level and (not elem.tail or not elem.tail.strip()):
                 elem.tail = i
 
-    def write(self, metadata=None, paragraphs=None, debug_mode=False, pretty_xml=True):
+    def write(self, metadata=None, paragraphs=None, debug_mode=False, pretty_xml=True,
+              referenced_only=False, image_workers=None, compression=None, compresslevel=None):
         """
         Write the book to a file
         :param metadata: Book metadata containing title, author, etc.
         :param paragraphs: Book content, either list of paragraphs or list of lists of paragraphs
         :param debug_mode: If true, create XML and JSON files for debugging
         :param pretty_xml: If true, create a pretty XML structure inside the FB2 file
+        :param referenced_only: If true, embed only the images referenced by <image l:href="#...">
+        in the description and the bodies, in the order of reference; unused and missing images are reported.
+        Otherwise all the images of images_dir are embedded in the order of their names
+        :param image_workers: number of threads encoding the images; by default, or if 1, the images
+        are streamed one by one, chunk by chunk, so none of them is held in memory
+        :param compression: 'zip' or 'gzip' to compress the book as it's written; by default
+        .fb2.zip and .fb2.gz file names are compressed, other ones are not
+        :param compresslevel: compression level from 0 to 9, the default one of the compressor if None
         """
         if metadata is not None:
             self.set_metadata(metadata)
@@ -200,19 +307,16 @@ class Fb2Writer:
         if not self.validate():
             raise ValueError("Invalid book structure")
 
-        # Handle images
-        self._encode_images()
-
         if pretty_xml:
             self.indent(self.root)
 
-        # Create XML tree
-        tree = et.ElementTree(self.root)
-        tree.write(self.file_name, encoding='utf-8', xml_declaration=True)
+        with open_output(self.file_name, compression, compresslevel) as book_file:
+            self._write_xml(book_file, pretty_xml, referenced_only, image_workers)
 
         if debug_mode:
             # Create XML and JSON files for debugging
-            tree.write(self.file_name + '.xml', encoding='utf-8', xml_declaration=True)
+            with open_book(self.file_name) as source, open(self.file_name + '.xml', 'wb') as xml_file:
+                shutil.copyfileobj(source, xml_file)
             # For JSON, we need to convert the XML tree to a dict
             root_dict = self.element_to_dict(self.root)
             with open(self.file_name + '.json', 'w', encoding='utf-8') as f:
@@ -255,24 +359,355 @@ class Fb2Writer:
             return False
         return True
 
-    def _encode_images(self):
+    def _write_xml(self, book_file, pretty_xml, referenced_only=False, image_workers=None):
+        """
+        Serialize the tree element by element and stream the images after it,
+        so the binaries are never kept in the tree
+        :param book_file: binary file object
+        :param pretty_xml: If true, indent the binaries the same way as the tree
+        :param referenced_only: see write()
+        :param image_workers: see write()
+        """
+        book_file.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        attributes = ''.join(f' {name}={quoteattr(value)}' for name, value in self.root.attrib.items())
+        book_file.write(f'<{self.root.tag}{attributes}>{self.root.text or ""}'.encode('utf-8'))
+        for child in self.root:
+            et(child).write(book_file, encoding='utf-8')
+        self._encode_images(book_file, '\n  ' if pretty_xml else '', referenced_only, image_workers)
+        book_file.write(f'</{self.root.tag}>'.encode('utf-8'))
+
+    def referenced_images(self):
+        """
+        Images referenced by <image l:href="#..."> in the description and the bodies, external links excluded
+        :return: list of binary ids in document order, without duplicates
+        """
+        referenced = {}
+        for image_elem in self.root.iter('image'):
+            href = image_elem.get('l:href') or image_elem.get(f'{XLINK_NAMESPACE}href') or ''
+            if href.startswith('#'):
+                referenced[href[1:]] = None
+        return list(referenced)
+
+    def _select_images(self, referenced_only):
+        """
+        :return: (images to embed as a list of (binary id, image path), unused image names, missing image names)
+        """
+        available = sorted(
+            filename for filename in os.listdir(self.images_dir)
+            if filename.split('.')[-1].lower() in IMAGE_EXTENSIONS
+        )
+        if not referenced_only:
+            return [(filename, os.path.join(self.images_dir, filename)) for filename in available], [], []
+        referenced = self.referenced_images()
+        available_set, referenced_set = set(available), set(referenced)
+        images = [(binary_id, os.path.join(self.images_dir, binary_id))
+                  for binary_id in referenced if binary_id in available_set]
+        unused = [filename for filename in available if filename not in referenced_set]
+        missing = [binary_id for binary_id in referenced if binary_id not in available_set]
+        return images, unused, missing
+
+    def _encode_images(self, book_file, tail='', referenced_only=False, image_workers=None):
         """
-        Encode images from the images directory to base64 and add them to the book structure
+        Stream images from the images directory into the book as <binary> elements, in a deterministic order.
+        Images are encoded chunk by chunk right into the book, so they are never held in memory.
+        With image_workers > 1, images up to PARALLEL_IMAGE_SIZE are encoded in a thread pool ahead
+        of the output instead, up to ENCODE_AHEAD_SIZE bytes of them at a time.
+        :param book_file: binary file object the book is written to
+        :param tail: whitespace after every element
+        :param referenced_only: see write()
+        :param image_workers: see write()
         """
         if not os.path.exists(self.images_dir):
             return
-        print(f'Encoding images... from {os.path.abspath(self.images_dir)}')
-        for filename in os.listdir(self.images_dir):
-            ext = filename.split('.')[-1].lower()
-            if ext in ['jpg', 'jpeg', 'png', 'gif']:
-                image_path = os.path.join(self.images_dir, filename)
-                with open(image_path, 'rb') as image_file:
-                    print(f'Encoding {filename}...')
-                    image_data = image_file.read()
-                    image_data_base64 = base64.b64encode(image_data).decode('utf-8')
-                    image_attributes = {
-                        "id": filename,
-                        "content-type": f"image/{ext}"
-                    }
-                    binary_elem = SubElement(self.root, "binary", attrib=image_attributes)
-                    binary_elem.text = image_data_base64
+        images, unused, missing = self._select_images(referenced_only)
+        if unused:
+            print(f"Not embedding {len(unused)} unreferenced images: {', '.join(unused)}")
+        if missing:
+            print(f"Referenced images not found in {os.path.abspath(self.images_dir)}: {', '.join(missing)}")
+
+        workers = image_workers or 1
+        # Number of images encoded ahead of the output
+        window = workers * 2
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            queue = collections.deque()
+            images_iter = iter(images)
+            image = next(images_iter, None)
+            ahead_size = 0
+            while queue or image is not None:
+                # Queue the next images while the window has room, at least one is always queued
+                while image is not None and (not queue or len(queue) < window):
+                    binary_id, image_path = image
+                    future = None
+                    size = 0
+                    if workers > 1 and os.path.getsize(image_path) <= PARALLEL_IMAGE_SIZE:
+                        size = _encoded_size(os.path.getsize(image_path))
+                        if queue and ahead_size + size > ENCODE_AHEAD_SIZE:
+                            break
+                        future = executor.submit(_encode_image, image_path)
+                    ahead_size += size
+                    queue.append((binary_id, image_path, future, size))
+                    image = next(images_iter, None)
+
+                binary_id, image_path, future, size = queue.popleft()
+                ext = binary_id.split('.')[-1].lower()
+                start_tag = f'<binary id={quoteattr(binary_id)} content-type={quoteattr(f"image/{ext}")}>'
+                book_file.write(start_tag.encode('utf-8'))
+                if future is not None:
+                    book_file.write(future.result())
+                else:
+                    with open(image_path, 'rb') as image_file:
+                        for chunk in iter_base64_lines(image_file):
+                            book_file.write(chunk)
+                book_file.write(f'</binary>{tail}'.encode('utf-8'))
+                ahead_size -= size
+        if images:
+            print(f'Embedded {len(images)} images from {os.path.abspath(self.images_dir)}')
+
+
+class Fb2StreamWriter:
+    """
+    Streaming FictionBook2 writer: the XML is generated incrementally and goes straight to the file,
+    so memory use doesn't depend on the book size. The header and description are written immediately,
+    then sections and paragraphs one by one, and the binaries at the end:
+        with Fb2StreamWriter('book.fb2', 'images') as writer:
+            writer.write_description(metadata)
+            writer.start_body()
+            writer.start_section(title='Chapter 1')
+            writer.write_paragraph('Text')
+            writer.end_section()
+    Open sections and the body are closed by close(), which also embeds the images of images_dir.
+    """
+
+    def __init__(self, file_name, images_dir=None, pretty_xml=True, compression=None, compresslevel=None):
+        """
+        :param file_name: path of the FB2 file, .fb2.zip and .fb2.gz files are compressed on the fly
+        :param images_dir: directory with the images embedded on close(), nothing is embedded if None
+        :param pretty_xml: If true, indent the XML the same way as Fb2Writer does
+        :param compression: 'zip' or 'gzip', chosen by the extension of file_name if None
+        :param compresslevel: compression level from 0 to 9, the default one of the compressor if None
+        """
+        self.file_name = file_name
+        self.images_dir = images_dir
+        self.pretty_xml = pretty_xml
+        self.metadata = None
+        self._file = open_output(file_name, compression, compresslevel)
+        self._xml = XMLGenerator(self._file, encoding='utf-8', short_empty_elements=True)
+        # Open elements: [tag, has child elements]
+        self._stack = []
+        self._in_body = False
+        self._has_body = False
+        self._has_binaries = False
+        self._xml.startDocument()
+        self._start('FictionBook', ROOT_ATTRIBUTES)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def write_description(self, metadata):
+        """
+        Write the <description> element right away
+        :param metadata: dict, see Fb2Writer.set_metadata()
+        """
+        if self.metadata is not None or self._has_body:
+            raise ValueError("Description must be written once, before the body")
+        check_metadata(metadata)
+        self.metadata = Element("description")
+        dict_to_element(self.metadata, metadata)
+        self.write_element(self.metadata)
+
+    def start_body(self, title=None, name=None):
+        """
+        Open a <body> element
+        :param title: title of the body, str or list of str for several <p>; book title if None
+        :param name: 'name' attribute, e.g. 'notes' for the footnotes body
+        """
+        if self.metadata is None:
+            raise ValueError("Description must be written before the body")
+        if self._in_body or self._has_binaries:
+            raise ValueError("Bodies can't be nested or follow binaries")
+        self._start('body', {'name': name} if name else {})
+        self._in_body = self._has_body = True
+        if title is None and name is None:
+            title = self.metadata.findtext('title-info/book-title')
+        if title:
+            self.write_title(title)
+
+    def end_body(self):
+        """
+        Close the open sections and the body
+        """
+        if not self._in_body:
+            raise ValueError("No open body")
+        while self._stack[-1][0] != 'body':
+            self._end()
+        self._end()
+        self._in_body = False
+
+    def start_section(self, title=None, section_id=None):
+        """
+        Open a <section> element, sections may be nested
+        :param title: title of the section, str or list of str for several <p>
+        :param section_id: 'id' attribute
+        """
+        self._check_body()
+        self._start('section', {'id': section_id} if section_id else {})
+        if title:
+            self.write_title(title)
+
+    def end_section(self):
+        if self._stack[-1][0] != 'section':
+            raise ValueError("No open section")
+        self._end()
+
+    def write_title(self, title):
+        """
+        :param title: str or list of str, every string is a <p> of the title
+        """
+        self._start('title', {})
+        for line in [title] if isinstance(title, str) else title:
+            self._leaf('p', line)
+        self._end()
+
+    def write_paragraph(self, text):
+        """
+        :param text: plain text of the paragraph
+        """
+        self._check_body()
+        self._leaf('p', text)
+
+    def write_paragraphs(self, paragraphs):
+        """
+        :param paragraphs: iterable of str
+        """
+        for paragraph in paragraphs:
+            self.write_paragraph(paragraph)
+
+    def write_empty_line(self):
+        self._check_body()
+        self._leaf('empty-line', None)
+
+    def write_element(self, elem):
+        """
+        Write a complete element, e.g. a poem or a paragraph with inline markup
+        :param elem: Element, either built with plain names or parsed, with names in Clark notation
+        """
+        if is_mixed_content(elem):
+            self._indent()
+            self._write_inline(elem)
+            self._stack[-1][1] = True
+            return
+        self._start(qualified_name(elem.tag), qualified_attributes(elem.attrib))
+        for child in elem:
+            self.write_element(child)
+        self._end()
+
+    def write_binary(self, binary_id, content_type, data):
+        """
+        Write a <binary> element, all bodies are closed before it
+        :param binary_id: 'id' attribute, referenced as <image l:href="#id"/>
+        :param content_type: e.g. 'image/jpeg'
+        :param data: bytes
+        """
+        self._start_binary(binary_id, content_type)
+        self._xml.characters(base64.encodebytes(data).decode('ascii'))
+        self._end_binary()
+
+    def write_image(self, image_path, binary_id=None):
+        """
+        Embed the image file as a <binary> element
+        :param image_path: path of the image
+        :param binary_id: 'id' attribute, the file name if None
+        """
+        file_name = os.path.basename(image_path)
+        ext = file_name.split('.')[-1].lower()
+        with open(image_path, 'rb') as image_file:
+            self._start_binary(binary_id or file_name, f"image/{ext}")
+            for chunk in iter_base64_lines(image_file):
+                self._xml.characters(chunk.decode('ascii'))
+            self._end_binary()
+
+    def write_images(self, images_dir=None):
+        """
+        Embed all the images of the directory
+        :param images_dir: directory with the images, self.images_dir if None
+        """
+        images_dir = images_dir or self.images_dir
+        if images_dir is None or not os.path.exists(images_dir):
+            return
+        for filename in sorted(os.listdir(images_dir)):
+            if filename.split('.')[-1].lower() in IMAGE_EXTENSIONS:
+                self.write_image(os.path.join(images_dir, filename))
+
+    def close(self):
+        """
+        Close the open elements, embed the images of images_dir unless binaries have been written already,
+        and finish the file
+        """
+        if self._file.closed:
+            return
+        if self._in_body:
+            self.end_body()
+        if not self._has_binaries:
+            self.write_images()
+        self._end()
+        if self.pretty_xml:
+            self._xml.ignorableWhitespace('\n')
+        self._xml.endDocument()
+        self._file.close()
+
+    def _check_body(self):
+        if not self._in_body:
+            raise ValueError("Body must be started first")
+
+    def _start_binary(self, binary_id, content_type):
+        if self._in_body:
+            self.end_body()
+        self._has_binaries = True
+        self._indent()
+        self._xml.startElement('binary', {'id': binary_id, 'content-type': content_type})
+
+    def _end_binary(self):
+        self._xml.endElement('binary')
+        self._stack[-1][1] = True
+
+    def _indent(self):
+        if self.pretty_xml and self._stack:
+            self._xml.ignorableWhitespace('\n' + '  ' * len(self._stack))
+
+    def _start(self, tag, attrs):
+        self._indent()
+        if self._stack:
+            self._stack[-1][1] = True
+        self._xml.startElement(tag, attrs)
+        self._stack.append([tag, False])
+
+    def _end(self):
+        tag, has_children = self._stack.pop()
+        if has_children and self.pretty_xml:
+            self._xml.ignorableWhitespace('\n' + '  ' * len(self._stack))
+        self._xml.endElement(tag)
+
+    def _leaf(self, tag, text):
+        self._indent()
+        self._stack[-1][1] = True
+        self._xml.startElement(tag, {})
+        if text:
+            self._xml.characters(text)
+        self._xml.endElement(tag)
+
+    def _write_inline(self, elem):
+        tag = qualified_name(elem.tag)
+        self._xml.startElement(tag, qualified_attributes(elem.attrib))
+        if elem.text:
+            self._xml.characters(elem.text)
+        for child in elem:
+            self._write_inline(child)
+            if child.tail:
+                self._xml.characters(child.tail)
+        self._xml.endElement(tag)
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from fictionbook.reader import Fb2Reader
+
+
+class Fictionbook2AsyncReaderTest(unittest.IsolatedAsyncioTestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.images_dir = self.temp_dir.name
+        self.book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def test_open(self):
+        reader = await Fb2Reader.open(self.book_path, self.images_dir)
+        self.assertEqual(len(reader.paragraphs), 2598)
+        self.assertEqual(reader.cover_image, 'cover.jpg')
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            process_reader = await Fb2Reader.open(self.book_path, self.images_dir, executor=executor,
+                                                  skip_binaries=True)
+        self.assertEqual(process_reader.paragraphs, reader.paragraphs)
+
+    async def test_images_async(self):
+        reader = await Fb2Reader.open(self.book_path, self.images_dir)
+        cover_path = os.path.join(self.images_dir, 'cover.jpg')
+        self.assertEqual(await reader.get_image_async('#cover.jpg'), cover_path)
+        self.assertEqual(reader.get_image('cover.jpg'), cover_path)
+        with self.assertRaises(KeyError):
+            await reader.get_image_async('missing.jpg')
+
+        image_paths = await reader.images_async()
+        self.assertEqual(image_paths, reader.images)
+        self.assertEqual(len(os.listdir(self.images_dir)), 22)
+
+    async def test_aiter_paragraphs(self):
+        reader = await Fb2Reader.open(self.book_path, self.images_dir)
+        paragraphs = [paragraph async for paragraph in reader.aiter_paragraphs(batch_size=100)]
+        self.assertEqual(paragraphs, reader.paragraphs)
+        paragraphs = [paragraph async for paragraph in reader.aiter_paragraphs(section=1)]
+        self.assertEqual(paragraphs, reader.paragraphs[4:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import pickle
+import tempfile
+import unittest
+import xml.etree.ElementTree as et
+
+from fictionbook.backends import ElementTreeBackend, LxmlBackend, available_backends, get_backend
+from fictionbook.reader import Fb2Reader
+
+
+class Fictionbook2BackendsTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend(), ElementTreeBackend)
+        self.assertIn(get_backend('auto').name, available_backends())
+        backend = ElementTreeBackend()
+        self.assertIs(get_backend(backend), backend)
+        with self.assertRaises(ValueError):
+            get_backend('sax')
+
+    @unittest.skipUnless('lxml' in available_backends(), "lxml is not installed")
+    def test_lxml_backend(self):
+        file_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        with tempfile.TemporaryDirectory() as images_dir:
+            reference = Fb2Reader(file_path, images_dir)
+            for skip_binaries in (False, True):
+                reader = Fb2Reader(file_path, images_dir, skip_binaries=skip_binaries,
+                                   backend=LxmlBackend(recover=True))
+                self.assertEqual(reader.paragraphs, reference.paragraphs)
+                self.assertEqual(reader.cover_image, 'cover.jpg')
+                self.assertEqual(sorted(reader.binaries), sorted(reference.binaries))
+                self.assertTrue(os.path.isfile(reader.cover))
+
+            metadata = get_backend('lxml').to_etree(reader.metadata)
+            self.assertEqual(et.tostring(metadata), et.tostring(reference.metadata))
+            pickle.dumps(metadata)
+
+            reader = Fb2Reader(file_path, images_dir, metadata_only=True, backend='lxml')
+            self.assertEqual(reader.cover_image, 'cover.jpg')
+
+        parts = [kind for kind, _ in Fb2Reader.stream(file_path, backend='lxml')]
+        self.assertEqual(parts.count('p'), len(reference.paragraphs))
+
+
+if __name__ == '__main__':
+    unittest.main()
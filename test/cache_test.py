@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fictionbook.cache import BookCache
+from fictionbook.reader import Fb2Reader
+
+
+class Fictionbook2CacheTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.images_dir = os.path.join(self.temp_dir, 'images')
+        for book in ('frost.fb2', 'sol_invictus_book1.fb2'):
+            shutil.copy(os.path.join(self.TEST_ASSETS_PATH, book), self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_warm_open(self):
+        book_path = os.path.join(self.temp_dir, 'sol_invictus_book1.fb2')
+        cache = BookCache(os.path.join(self.temp_dir, 'cache'))
+        reader = Fb2Reader(book_path, images_dir=self.images_dir, cache=cache)
+        self.assertIsNotNone(reader.root)
+
+        cached_reader = Fb2Reader(book_path, images_dir=self.images_dir, cache=cache)
+        self.assertIsNone(cached_reader.root)
+        self.assertEqual(cached_reader.metadata.find('.//{http://www.gribuser.ru/xml/fictionbook/2.0}book-title').text,
+                         'Непобедимое солнце. Книга 1')
+        self.assertEqual(cached_reader.paragraphs, reader.paragraphs)
+        self.assertEqual([(chapter.start, chapter.end) for chapter in cached_reader.chapters],
+                         [(chapter.start, chapter.end) for chapter in reader.chapters])
+        self.assertEqual(list(cached_reader.iter_paragraphs(section=1)), list(reader.iter_paragraphs(section=1)))
+        self.assertEqual(list(cached_reader.binaries), list(reader.binaries))
+        self.assertEqual(cached_reader.binaries['i_001.png'].read(), reader.binaries['i_001.png'].read())
+        self.assertEqual(cached_reader.cover, os.path.join(self.images_dir, 'cover.jpg'))
+
+        # a modified book is parsed again
+        with open(book_path, 'ab') as book_file:
+            book_file.write(b'\n')
+        self.assertIsNotNone(Fb2Reader(book_path, images_dir=self.images_dir, cache=cache).root)
+
+    def test_compact_restore(self):
+        book_path = os.path.join(self.temp_dir, 'sol_invictus_book1.fb2')
+        cache = BookCache(os.path.join(self.temp_dir, 'cache'))
+        Fb2Reader(book_path, images_dir=self.images_dir, cache=cache)
+
+        compact_reader = Fb2Reader(book_path, images_dir=self.images_dir, compact=True, cache=cache)
+        uncached_reader = Fb2Reader(book_path, images_dir=self.images_dir, compact=True)
+        self.assertEqual(list(compact_reader.paragraphs.flags), list(uncached_reader.paragraphs.flags))
+        self.assertEqual(compact_reader.paragraphs.flag(0), uncached_reader.paragraphs.flag(0))
+
+        # the compact entry serves both kinds of readers
+        cached_reader = Fb2Reader(book_path, images_dir=self.images_dir, compact=True, cache=cache)
+        self.assertIsNone(cached_reader.root)
+        self.assertEqual(list(cached_reader.paragraphs.flags), list(uncached_reader.paragraphs.flags))
+        plain_reader = Fb2Reader(book_path, images_dir=self.images_dir, cache=cache)
+        self.assertIsNone(plain_reader.root)
+        self.assertEqual(plain_reader.paragraphs, list(uncached_reader.paragraphs))
+
+    def test_corrupt_entry(self):
+        book_path = os.path.join(self.temp_dir, 'frost.fb2')
+        cache = BookCache(os.path.join(self.temp_dir, 'cache'))
+        for content in (b'', b'garbage', b'cmissing_module\nName\n.', b'\x80\x05K\x01.'):
+            with open(cache.entry_path(book_path), 'wb') as entry_file:
+                entry_file.write(content)
+            self.assertIsNone(cache.load(book_path))
+            self.assertIsNotNone(Fb2Reader(book_path, images_dir=self.images_dir, cache=cache).root)
+            self.assertIsNone(Fb2Reader(book_path, images_dir=self.images_dir, cache=cache).root)
+
+    def test_eviction(self):
+        book_paths = []
+        for number in range(3):
+            book_path = os.path.join(self.temp_dir, f'frost{number}.fb2')
+            shutil.copy(os.path.join(self.temp_dir, 'frost.fb2'), book_path)
+            book_paths.append(book_path)
+        cache = BookCache(os.path.join(self.temp_dir, 'cache'))
+        Fb2Reader(book_paths[0], images_dir=self.images_dir, cache=cache)
+        entry_size = os.path.getsize(cache.entry_path(book_paths[0]))
+
+        # room for two entries only
+        cache.max_bytes = entry_size * 2 + entry_size // 2
+        Fb2Reader(book_paths[1], images_dir=self.images_dir, cache=cache)
+        os.utime(cache.entry_path(book_paths[0]), ns=(1, 1))
+        os.utime(cache.entry_path(book_paths[1]), ns=(2, 2))
+        # a warm open marks the first entry as recently used
+        self.assertIsNone(Fb2Reader(book_paths[0], images_dir=self.images_dir, cache=cache).root)
+        Fb2Reader(book_paths[2], images_dir=self.images_dir, cache=cache)
+        self.assertEqual(sorted(os.listdir(cache.cache_dir)),
+                         sorted(os.path.basename(cache.entry_path(path)) for path in (book_paths[0], book_paths[2])))
+
+
+if __name__ == '__main__':
+    unittest.main()
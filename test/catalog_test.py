@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fictionbook.catalog import Catalog
+
+
+class Fictionbook2CatalogTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.library_dir = os.path.join(self.temp_dir, 'library')
+        os.mkdir(self.library_dir)
+        for book in ('frost.fb2', 'transients_in_arcadia.fb2', 'sol_invictus_book1.fb2'):
+            shutil.copy(os.path.join(self.TEST_ASSETS_PATH, book), self.library_dir)
+        self.catalog = Catalog(os.path.join(self.temp_dir, 'catalog.sqlite'))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_incremental_scan(self):
+        current_dir = os.getcwd()
+        os.chdir(self.temp_dir)
+        try:
+            stats = self.catalog.scan(self.library_dir, workers=2)
+        finally:
+            os.chdir(current_dir)
+        self.assertEqual(stats['added'], 3)
+        self.assertEqual(stats['failed'], 0)
+        # Nothing is written outside the database
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['catalog.sqlite', 'library'])
+
+        book = self.catalog.get(os.path.join(self.library_dir, 'sol_invictus_book1.fb2'))
+        self.assertEqual(book['title'], 'Непобедимое солнце. Книга 1')
+        self.assertEqual(book['authors'], ['Виктор Олегович Пелевин'])
+        self.assertEqual(book['genre'], 'prose_contemporary')
+        self.assertEqual(book['lang'], 'ru')
+        self.assertEqual(book['sequence_name'], 'Непобедимое солнце')
+        self.assertEqual(book['cover'], 'cover.jpg')
+        self.assertEqual(book['paragraphs'], 2598)
+
+        stats = self.catalog.scan(self.library_dir, workers=2)
+        self.assertEqual(stats['unchanged'], 3)
+        self.assertEqual(stats['added'] + stats['updated'], 0)
+
+        frost_path = os.path.join(self.library_dir, 'frost.fb2')
+        os.utime(frost_path, ns=(0, 0))
+        stats = self.catalog.scan(self.library_dir, workers=2)
+        self.assertEqual(stats['touched'], 1)
+        self.assertEqual(stats['updated'], 0)
+
+        with open(frost_path, 'r', encoding='utf-8') as book_file:
+            content = book_file.read()
+        with open(frost_path, 'w', encoding='utf-8') as book_file:
+            book_file.write(content.replace('Frost\n', 'Hoarfrost\n', 1))
+        os.remove(os.path.join(self.library_dir, 'transients_in_arcadia.fb2'))
+        stats = self.catalog.scan(self.library_dir, workers=2)
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(stats['removed'], 1)
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(self.catalog.get(frost_path)['title'], 'Hoarfrost')
+        self.assertEqual(len(list(self.catalog.books())), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
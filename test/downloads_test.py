@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fictionbook.downloads import ImageDownloader
+from fictionbook.reader import Fb2Reader
+
+IMAGE_CONTENT = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 64
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in image server, supports ETag revalidation
+    """
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    # Close the connection after every response without telling the client, like an idle timeout
+    drop_connections = False
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/missing.png':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(IMAGE_CONTENT)))
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            self.wfile.write(IMAGE_CONTENT)
+        if self.drop_connections:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class Fictionbook2DownloadsTest(unittest.TestCase):
+
+    def setUp(self):
+        ImageHandler.requests = []
+        ImageHandler.drop_connections = False
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_cached(self):
+        urls = [f'{self.base_url}/image{number}.png' for number in range(5)] + [f'{self.base_url}/missing.png']
+        images_dir = os.path.join(self.temp_dir, 'images')
+        os.mkdir(images_dir)
+        with ImageDownloader(cache_dir=os.path.join(self.temp_dir, 'cache'), max_workers=3, retries=0) as downloader:
+            downloaded = downloader.download(urls, images_dir)
+            self.assertEqual(set(downloaded), set(urls[:5]))
+            for image_path in downloaded.values():
+                with open(image_path, 'rb') as image_file:
+                    self.assertEqual(image_file.read(), IMAGE_CONTENT)
+            self.assertTrue(all(etag is None for _, etag in ImageHandler.requests))
+
+            ImageHandler.requests = []
+            self.assertEqual(downloader.download(urls[:5], images_dir), downloaded)
+            # cached images are revalidated, not downloaded again
+            self.assertEqual(sorted(etag for _, etag in ImageHandler.requests), ['"v1"'] * 5)
+
+    def test_stale_connection(self):
+        ImageHandler.drop_connections = True
+        urls = [f'{self.base_url}/image{number}.png' for number in range(3)]
+        with ImageDownloader(max_workers=1, retries=0, backoff=0) as downloader:
+            downloaded = downloader.download(urls, self.temp_dir)
+        # The requests on the closed connection are resent without using up the retries
+        self.assertEqual(set(downloaded), set(urls))
+        self.assertEqual(len(ImageHandler.requests), 3)
+
+    def test_reader_download_images(self):
+        book_path = os.path.join(self.temp_dir, 'remote_images.fb2')
+        with open(book_path, 'w', encoding='utf-8') as book_file:
+            book_file.write(f'<?xml version="1.0" encoding="utf-8"?>'
+                            f'<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" '
+                            f'xmlns:l="http://www.w3.org/1999/xlink">'
+                            f'<description><title-info><book-title>Remote</book-title></title-info></description>'
+                            f'<body><section><p>Text</p><image l:href="{self.base_url}/remote.png"/>'
+                            f'<image l:href="{self.base_url}/remote.png"/></section></body>'
+                            f'</FictionBook>')
+        images_dir = os.path.join(self.temp_dir, 'images')
+        reader = Fb2Reader(book_path, images_dir=images_dir, download_images=True)
+        self.assertEqual(reader.images, [os.path.join(images_dir, 'remote.png')])
+        self.assertEqual(len(ImageHandler.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
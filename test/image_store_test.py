@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fictionbook.image_store import ImageStore
+from fictionbook.reader import Fb2Reader
+
+
+class Fictionbook2ImageStoreTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = ImageStore(os.path.join(self.temp_dir, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _object_count(self):
+        return sum(len(files) for _, _, files in os.walk(self.store.objects_dir))
+
+    def test_deduplication(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        images_dir = os.path.join(self.temp_dir, 'images')
+        reader = Fb2Reader(test_book_path, images_dir=images_dir)
+
+        manifest = self.store.add_book(reader, 'sol_invictus/book1')
+        self.assertEqual(set(manifest), set(reader.binaries))
+        objects = self._object_count()
+        self.assertEqual(objects, len({entry['digest'] for entry in manifest.values()}))
+
+        # the same images of another book are not stored again
+        self.store.add_book(Fb2Reader(test_book_path, images_dir=images_dir), 'sol_invictus/book1 copy')
+        self.assertEqual(self._object_count(), objects)
+        self.assertEqual(self.store.manifest('sol_invictus/book1 copy'), manifest)
+
+        cover_path = self.store.image_path('sol_invictus/book1', '#cover.jpg')
+        with open(cover_path, 'rb') as cover_file:
+            self.assertEqual(cover_file.read(), reader.binaries['cover.jpg'].read())
+
+        export_dir = os.path.join(self.temp_dir, 'export')
+        exported = self.store.export_book('sol_invictus/book1', export_dir)
+        self.assertEqual(len(exported), len(manifest))
+        self.assertTrue(os.path.samefile(os.path.join(export_dir, 'cover.jpg'), cover_path))
+
+    def test_reader_image_store(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        images_dir = os.path.join(self.temp_dir, 'images')
+        reader = Fb2Reader(test_book_path, images_dir=images_dir, image_store=self.store)
+        self.assertTrue(reader.cover.startswith(self.store.objects_dir))
+        self.assertEqual(os.listdir(images_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as et
+
+from fictionbook.index import Fb2Index
+from fictionbook.reader import FB2_NAMESPACE, Fb2Reader
+
+
+class Fictionbook2IndexTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.book_path = os.path.join(self.temp_dir, 'sol_invictus_book1.fb2')
+        shutil.copy(os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2'), self.book_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_load_section(self):
+        reader = Fb2Reader(self.book_path, images_dir=os.path.join(self.temp_dir, 'images'))
+        sections = reader.body.findall(f'{FB2_NAMESPACE}section')
+
+        index = Fb2Index.open(self.book_path)
+        self.assertTrue(os.path.isfile(self.book_path + '.idx.json'))
+        self.assertEqual(len(index.sections), len(sections))
+        self.assertEqual(len(index.data['bodies']), 2)
+        for number, section in enumerate(sections):
+            section.tail = None
+            self.assertEqual(et.tostring(index.load_section(number)), et.tostring(section))
+        self.assertEqual(et.tostring(Fb2Reader.load_section(self.book_path, 1)), et.tostring(sections[1]))
+        self.assertEqual(index.binary('cover.jpg').read(), reader.binaries['cover.jpg'].read())
+
+    def test_attribute_with_gt(self):
+        book_path = os.path.join(self.temp_dir, 'gt.fb2')
+        with open(book_path, 'wb') as book_file:
+            book_file.write(b'<?xml version="1.0" encoding="utf-8"?>\n'
+                            b'<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" '
+                            b'xmlns:l="http://www.w3.org/1999/xlink" data-note="a > b">'
+                            b'<description><title-info><book-title>Gt</book-title></title-info></description>'
+                            b'<body title="1 > 0"><section id="one" title=\'x > y\'><p>First</p></section>'
+                            b'<section id="empty" title="/>"/><section id="two"><p>Second</p></section></body>'
+                            b'<binary id="a.png" content-type="image/png" title="p > q">AAEC</binary>'
+                            b'<binary id="b>c.png" content-type="image/png">AAED</binary></FictionBook>')
+        reader = Fb2Reader(book_path, images_dir=os.path.join(self.temp_dir, 'images'))
+        sections = reader.body.findall(f'{FB2_NAMESPACE}section')
+
+        index = Fb2Index.open(book_path)
+        self.assertEqual(len(index.sections), 3)
+        for number, section in enumerate(sections):
+            section.tail = None
+            self.assertEqual(et.tostring(index.load_section(number)), et.tostring(section))
+        self.assertEqual(index.binary('a.png').read(), b'\x00\x01\x02')
+        self.assertEqual(index.binary('b>c.png').read(), b'\x00\x01\x03')
+        lazy_reader = Fb2Reader(book_path, images_dir=os.path.join(self.temp_dir, 'images'), skip_binaries=True)
+        self.assertEqual(lazy_reader.binaries['b>c.png'].read(), b'\x00\x01\x03')
+
+    def test_stale_index(self):
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        index = Fb2Index.open(self.book_path, cache_dir=cache_dir)
+        self.assertEqual(os.listdir(cache_dir), [os.path.basename(Fb2Index.index_path(self.book_path, cache_dir))])
+
+        with open(self.book_path, 'ab') as book_file:
+            book_file.write(b'\n')
+        rebuilt_index = Fb2Index.open(self.book_path, cache_dir=cache_dir)
+        self.assertEqual(rebuilt_index.data['size'], index.data['size'] + 1)
+        self.assertEqual(rebuilt_index.sections, index.sections)
+
+    def test_path_like(self):
+        book_path = pathlib.Path(self.book_path)
+        self.assertEqual(Fb2Index.index_path(book_path), self.book_path + '.idx.json')
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        self.assertEqual(Fb2Index.index_path(book_path, cache_dir), Fb2Index.index_path(self.book_path, cache_dir))
+        self.assertEqual(Fb2Index.open(book_path).sections, Fb2Index.open(self.book_path).sections)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fictionbook.library import book_stem, book_summary, extract_covers, find_books, process_library
+
+
+def crashing_summary(file_path):
+    """
+    Processor that takes down its worker process on the 'crash' book
+    """
+    if os.path.basename(file_path).startswith('crash'):
+        os._exit(1)
+    return book_summary(file_path, metadata_only=True)
+
+
+class Fictionbook2LibraryTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.library_dir = tempfile.mkdtemp()
+        for book in ('frost.fb2', 'transients_in_arcadia.fb2', 'sol_invictus_book1.fb2'):
+            shutil.copy(os.path.join(self.TEST_ASSETS_PATH, book), self.library_dir)
+        # A book without <body> must be reported, not break the run
+        with open(os.path.join(self.library_dir, 'broken.fb2'), 'w', encoding='utf-8') as book_file:
+            book_file.write('<?xml version="1.0" encoding="utf-8"?>'
+                            '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">'
+                            '<description><title-info><book-title>Broken</book-title></title-info></description>'
+                            '</FictionBook>')
+
+    def tearDown(self):
+        shutil.rmtree(self.library_dir)
+
+    def test_book_summary(self):
+        summary = book_summary(os.path.join(self.library_dir, 'sol_invictus_book1.fb2'), images_dir=self.library_dir)
+        self.assertEqual(summary['title'], 'Непобедимое солнце. Книга 1')
+        self.assertEqual(summary['authors'], ['Виктор Олегович Пелевин'])
+        self.assertEqual(summary['genres'], ['prose_contemporary'])
+        self.assertEqual(summary['lang'], 'ru')
+        self.assertEqual(summary['sequence'], {'name': 'Непобедимое солнце', 'number': '1'})
+        self.assertEqual(summary['cover'], 'cover.jpg')
+        self.assertEqual(summary['binaries'], 22)
+
+    def test_process_library(self):
+        books = find_books(self.library_dir)
+        self.assertEqual(len(books), 4)
+
+        results = {os.path.basename(result.path): result
+                   for result in process_library(books, workers=2, chunk_size=2)}
+        self.assertEqual(set(results), {os.path.basename(book) for book in books})
+        self.assertFalse(results['broken.fb2'].ok)
+        self.assertEqual(results['broken.fb2'].error, "ValueError: Body not found")
+        self.assertEqual(results['frost.fb2'].data['title'], 'Frost')
+        self.assertEqual(results['frost.fb2'].data['paragraphs'], 46)
+        self.assertEqual(results['transients_in_arcadia.fb2'].data['authors'], ['O. Henry'])
+
+    def test_worker_crash(self):
+        frost_path = os.path.join(self.library_dir, 'frost.fb2')
+        for number in range(10):
+            shutil.copy(frost_path, os.path.join(self.library_dir, f'frost{number}.fb2'))
+        shutil.copy(frost_path, os.path.join(self.library_dir, 'crash.fb2'))
+        books = find_books(self.library_dir)
+
+        results = [result for result in process_library(books, crashing_summary, workers=2, chunk_size=2)]
+        self.assertEqual(sorted(result.path for result in results), sorted(books))
+        failed = {os.path.basename(result.path): result.error for result in results if not result.ok}
+        self.assertEqual(failed, {'crash.fb2': "BrokenProcessPool: the worker process crashed"})
+
+    def test_book_summary_images_dir(self):
+        current_dir = os.getcwd()
+        os.chdir(self.library_dir)
+        try:
+            summary = book_summary('frost.fb2')
+        finally:
+            os.chdir(current_dir)
+        self.assertEqual(summary['paragraphs'], 46)
+        self.assertFalse(os.path.exists(os.path.join(self.library_dir, 'images')))
+
+    def test_extract_covers(self):
+        covers_dir = os.path.join(self.library_dir, 'covers')
+        results = {os.path.basename(result.path): result
+                   for result in extract_covers(self.library_dir, covers_dir, workers=2, chunk_size=2)}
+        self.assertEqual(results['sol_invictus_book1.fb2'].data['cover'],
+                         os.path.join(covers_dir, 'sol_invictus_book1.jpg'))
+        self.assertIsNone(results['frost.fb2'].data['cover'])
+        # Only the description is needed, so a book without a body is fine
+        self.assertTrue(results['broken.fb2'].ok)
+        self.assertEqual(os.listdir(covers_dir), ['sol_invictus_book1.jpg'])
+        self.assertEqual(book_stem('/library/frost.fb2.zip'), 'frost')
+
+
+if __name__ == '__main__':
+    unittest.main()
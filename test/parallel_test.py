@@ -0,0 +1,78 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from fictionbook.parallel import parse_parallel, scan_body, split_body
+from fictionbook.reader import Fb2Reader
+
+
+def chapter_tree(chapters):
+    return [(c.title, c.id, c.depth, c.start, c.end, chapter_tree(c.children)) for c in chapters]
+
+
+class Fictionbook2ParallelTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_scan_body(self):
+        with open(os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2'), 'rb') as book_file:
+            data = book_file.read()
+        layout = scan_body(data)
+        self.assertTrue(layout.root_tag.startswith(b'<FictionBook'))
+        self.assertEqual(len(layout.sections), 2)
+        for start, end in layout.sections:
+            self.assertTrue(data[start:end].startswith(b'<section'))
+            self.assertTrue(data[start:end].endswith(b'</section>'))
+        ranges = split_body(layout, 1)
+        self.assertEqual(ranges[0][0], layout.content_start)
+        self.assertEqual(ranges[-1][1], layout.content_end)
+        self.assertEqual(split_body(layout, len(data)), [(layout.content_start, layout.content_end)])
+
+    def test_scan_body_attribute_with_gt(self):
+        data = (b'<?xml version="1.0" encoding="utf-8"?>\n'
+                b'<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" data-note="a > b">'
+                b'<body title="1 > 0"><section id="one" title=\'x > y\'><p>First</p></section>'
+                b'<section id="empty" title="/>"/><section id="two"><p>Second</p></section></body></FictionBook>')
+        layout = scan_body(data)
+        self.assertEqual(layout.root_tag, data[data.index(b'<FictionBook'):data.index(b'<body')])
+        self.assertEqual(layout.body_tag, b'<body title="1 > 0">')
+        self.assertEqual([data[start:end] for start, end in layout.sections], [
+            b'<section id="one" title=\'x > y\'><p>First</p></section>',
+            b'<section id="empty" title="/>"/>',
+            b'<section id="two"><p>Second</p></section>',
+        ])
+
+    def test_parse_parallel(self):
+        for file_name in ('frost.fb2', 'sol_invictus_book1.fb2', 'transients_in_arcadia.fb2'):
+            file_path = os.path.join(self.TEST_ASSETS_PATH, file_name)
+            reader = Fb2Reader(file_path, self.temp_dir, compact=True)
+            paragraphs, chapters, stats = parse_parallel(file_path, workers=2, compact=True, slice_size=1)
+            self.assertEqual(list(paragraphs), list(reader.paragraphs))
+            self.assertEqual(list(paragraphs.flags), list(reader.paragraphs.flags))
+            self.assertEqual(chapter_tree(chapters), chapter_tree(reader.chapters))
+            self.assertEqual(stats['paragraphs'], len(reader.paragraphs))
+            self.assertGreater(stats['slices'], 1)
+
+        paragraphs, _, stats = parse_parallel(file_path, workers=2)
+        self.assertEqual(paragraphs, list(reader.paragraphs))
+        self.assertEqual(stats['words'], sum(len(paragraph.split()) for paragraph in paragraphs))
+
+    def test_compressed_fallback(self):
+        gz_path = os.path.join(self.temp_dir, 'frost.fb2.gz')
+        with open(os.path.join(self.TEST_ASSETS_PATH, 'frost.fb2'), 'rb') as book_file:
+            with gzip.open(gz_path, 'wb') as gz_file:
+                shutil.copyfileobj(book_file, gz_file)
+        paragraphs, chapters, stats = parse_parallel(gz_path, workers=2)
+        self.assertEqual(len(paragraphs), 46)
+        self.assertEqual(stats['slices'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,25 @@
+import io
+import itertools
 import os
+import gzip
+import shutil
+import zipfile
+import tempfile
 import unittest
-from fictionbook.reader import Fb2Reader
+import xml.etree.ElementTree as et
+from fictionbook.reader import FB2_NAMESPACE, Fb2Reader
+from fictionbook.binaries import extract_binaries
 
 
 class Fictionbook2ReaderTest(unittest.TestCase):
     TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
 
+    def setUp(self):
+        self.images_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.images_dir)
+
     def test_book1_metadata(self):
         test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
         expected_metadata = {
@@ -47,9 +61,9 @@ class Fictionbook2ReaderTest(unittest.TestCase):
         }
         expected_chapters = 2
         expected_paragraphs = 2596
-        expected_cover = './images/cover.jpg'
+        expected_cover = os.path.join(self.images_dir, 'cover.jpg')
 
-        reader = Fb2Reader(test_book_path, images_dir='./images')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
         self.assertEqual(reader.metadata, expected_metadata)
         self.assertEqual(len(reader.chapters), expected_chapters)
         self.assertEqual(len(reader.paragraphs), expected_paragraphs)
@@ -62,7 +76,7 @@ class Fictionbook2ReaderTest(unittest.TestCase):
         expected_paragraphs = 44
         expected_cover = None
 
-        reader = Fb2Reader(test_book_path, images_dir='./images')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
         self.assertEqual(reader.metadata, expected_metadata)
         self.assertEqual(len(reader.chapters), expected_chapters)
         self.assertEqual(len(reader.paragraphs), expected_paragraphs)
@@ -75,7 +89,7 @@ class Fictionbook2ReaderTest(unittest.TestCase):
         expected_paragraphs = 35
         expected_cover = None
 
-        reader = Fb2Reader(test_book_path, images_dir='./images')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
         self.assertEqual(reader.metadata, expected_metadata)
         self.assertEqual(len(reader.chapters), expected_chapters)
         self.assertEqual(len(reader.paragraphs), expected_paragraphs)
@@ -84,33 +98,192 @@ class Fictionbook2ReaderTest(unittest.TestCase):
     def test_images(self):
         test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
         expected_images_content = [
-            './images/cover.jpg',
-            './images/i_001.png',
-            './images/i_002.png',
-            './images/i_003.png',
-            './images/i_004.png',
-            './images/i_005.png',
-            './images/i_006.png',
-            './images/i_007.png',
-            './images/i_008.png',
-            './images/i_009.png',
-            './images/i_010.png',
-            './images/i_011.png',
-            './images/i_012.png',
-            './images/i_013.png',
-            './images/i_014.png',
-            './images/i_015.png',
-            './images/i_016.png',
-            './images/i_017.png',
-            './images/i_018.png',
-            './images/i_019.png',
-            './images/i_020.png',
-            './images/i_021.png',
+            os.path.join(self.images_dir, 'cover.jpg'),
+            os.path.join(self.images_dir, 'i_001.png'),
+            os.path.join(self.images_dir, 'i_002.png'),
+            os.path.join(self.images_dir, 'i_003.png'),
+            os.path.join(self.images_dir, 'i_004.png'),
+            os.path.join(self.images_dir, 'i_005.png'),
+            os.path.join(self.images_dir, 'i_006.png'),
+            os.path.join(self.images_dir, 'i_007.png'),
+            os.path.join(self.images_dir, 'i_008.png'),
+            os.path.join(self.images_dir, 'i_009.png'),
+            os.path.join(self.images_dir, 'i_010.png'),
+            os.path.join(self.images_dir, 'i_011.png'),
+            os.path.join(self.images_dir, 'i_012.png'),
+            os.path.join(self.images_dir, 'i_013.png'),
+            os.path.join(self.images_dir, 'i_014.png'),
+            os.path.join(self.images_dir, 'i_015.png'),
+            os.path.join(self.images_dir, 'i_016.png'),
+            os.path.join(self.images_dir, 'i_017.png'),
+            os.path.join(self.images_dir, 'i_018.png'),
+            os.path.join(self.images_dir, 'i_019.png'),
+            os.path.join(self.images_dir, 'i_020.png'),
+            os.path.join(self.images_dir, 'i_021.png'),
         ]
-        reader = Fb2Reader(test_book_path, images_dir='./images')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
         # compare sets of images to handle different order of sorting
         self.assertEqual(set(reader.images), set(expected_images_content))
 
+    def test_stream(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+
+        paragraphs = []
+        sections = 0
+        descriptions = 0
+        for kind, elem in Fb2Reader.stream(test_book_path):
+            if kind == 'p':
+                text_content = ''.join(elem.itertext())
+                if text_content:
+                    paragraphs.append(text_content.strip())
+            elif kind == 'section':
+                sections += 1
+                # paragraphs are released before the section is yielded
+                self.assertEqual(len(elem), 0)
+            elif kind == 'description':
+                descriptions += 1
+        self.assertEqual(descriptions, 1)
+        self.assertEqual(sections, 2)
+        self.assertEqual(paragraphs, reader.paragraphs)
+
+    def test_metadata_only(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        full_reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir, metadata_only=True)
+        self.assertEqual(et.tostring(reader.metadata), et.tostring(full_reader.metadata))
+        self.assertEqual(reader.cover, full_reader.cover)
+        self.assertIsNone(reader.body)
+        self.assertEqual(reader.paragraphs, [])
+
+    def test_lazy_images(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        with tempfile.TemporaryDirectory() as images_dir:
+            reader = Fb2Reader(test_book_path, images_dir=images_dir)
+            self.assertEqual(len(reader.binaries), 22)
+            self.assertEqual(os.listdir(images_dir), [])
+
+            image_path = reader.get_image('#i_001.png')
+            self.assertEqual(image_path, os.path.join(images_dir, 'i_001.png'))
+            self.assertEqual(os.listdir(images_dir), ['i_001.png'])
+            with open(image_path, 'rb') as image_file:
+                self.assertEqual(image_file.read(8), b'\x89PNG\r\n\x1a\n')
+
+    def test_extract_binaries(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        with tempfile.TemporaryDirectory() as images_dir:
+            extracted = extract_binaries(test_book_path, images_dir)
+            self.assertEqual(set(extracted), set(reader.binaries))
+            for binary_id, image_path in extracted.items():
+                with open(image_path, 'rb') as image_file:
+                    self.assertEqual(image_file.read(), reader.binaries[binary_id].read())
+
+            extracted = extract_binaries(test_book_path, images_dir, binary_ids={'cover.jpg'})
+            self.assertEqual(extracted, {'cover.jpg': os.path.join(images_dir, 'cover.jpg')})
+
+    def test_skip_binaries(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        with tempfile.TemporaryDirectory() as images_dir:
+            skipping_reader = Fb2Reader(test_book_path, images_dir=images_dir, skip_binaries=True)
+            self.assertEqual(skipping_reader.paragraphs, reader.paragraphs)
+            self.assertEqual(len(skipping_reader.root.findall(f'{FB2_NAMESPACE}binary')), 0)
+            self.assertEqual(list(skipping_reader.binaries), list(reader.binaries))
+            for binary_id, binary in skipping_reader.binaries.items():
+                self.assertIsNone(binary.element)
+                self.assertEqual(binary.read(), reader.binaries[binary_id].read())
+            self.assertEqual(skipping_reader.cover, os.path.join(images_dir, 'cover.jpg'))
+
+    def test_compressed_sources(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        with open(test_book_path, 'rb') as book_file:
+            book_content = book_file.read()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = os.path.join(temp_dir, 'sol_invictus_book1.fb2.zip')
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr('sol_invictus_book1.fb2', book_content)
+            gzip_path = os.path.join(temp_dir, 'sol_invictus_book1.fb2.gz')
+            with gzip.open(gzip_path, 'wb') as gzip_file:
+                gzip_file.write(book_content)
+
+            for source in [zip_path, gzip_path, book_content, io.BytesIO(book_content)]:
+                compressed_reader = Fb2Reader(source, images_dir=temp_dir)
+                self.assertEqual(compressed_reader.paragraphs, reader.paragraphs)
+                self.assertEqual(list(compressed_reader.binaries), list(reader.binaries))
+
+            for source in [zip_path, gzip_path]:
+                metadata_reader = Fb2Reader(source, images_dir=temp_dir, metadata_only=True)
+                self.assertEqual(metadata_reader.cover_image, 'cover.jpg')
+
+    def test_extract_cover(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        with open(test_book_path, 'rb') as book_file:
+            book_content = book_file.read()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            gzip_path = os.path.join(temp_dir, 'sol_invictus_book1.fb2.gz')
+            with gzip.open(gzip_path, 'wb') as gzip_file:
+                gzip_file.write(book_content)
+            covers_dir = os.path.join(temp_dir, 'covers')
+
+            cover_path = Fb2Reader.extract_cover(test_book_path, covers_dir)
+            self.assertEqual(cover_path, os.path.join(covers_dir, 'cover.jpg'))
+            cover_path = Fb2Reader.extract_cover(gzip_path, covers_dir, image_name='sol_invictus')
+            self.assertEqual(cover_path, os.path.join(covers_dir, 'sol_invictus.jpg'))
+            self.assertEqual(sorted(os.listdir(covers_dir)), ['cover.jpg', 'sol_invictus.jpg'])
+            for file_name in os.listdir(covers_dir):
+                with open(os.path.join(covers_dir, file_name), 'rb') as image_file:
+                    self.assertEqual(image_file.read(), reader.binaries['cover.jpg'].read())
+
+            no_cover_path = os.path.join(self.TEST_ASSETS_PATH, 'frost.fb2')
+            self.assertIsNone(Fb2Reader.extract_cover(no_cover_path, covers_dir))
+
+    def test_iter_paragraphs(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+
+        first_paragraphs = list(itertools.islice(reader.iter_paragraphs(), 3))
+        self.assertEqual(first_paragraphs, ['Виктор Пелевин', 'Непобедимое Солнце. Книга I', '© В. О. Пелевин, текст, 2020'])
+        self.assertIs(reader.paragraphs, reader.paragraphs)
+        self.assertEqual(list(reader.iter_paragraphs()), reader.paragraphs)
+
+        # the second chapter goes right after the title and 2 paragraphs of the first one
+        self.assertEqual(list(reader.iter_paragraphs(section=1)), reader.paragraphs[4:])
+        with self.assertRaises(KeyError):
+            next(reader.iter_paragraphs(section='missing'))
+
+    def test_chapters(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        reader = Fb2Reader(test_book_path, images_dir=self.images_dir)
+        self.assertEqual([(chapter.start, chapter.end) for chapter in reader.chapters], [(2, 4), (4, 2598)])
+
+        book_content = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">'
+            '<description><title-info><book-title>Nested</book-title></title-info></description>'
+            '<body><title><p>Nested</p></title>'
+            '<section id="part1"><title><p>Part 1</p></title>'
+            '<section id="ch1"><title><p>Chapter 1</p><p>Beginning</p></title><p>One</p><p>Two</p></section>'
+            '<section id="ch2"><title><p>Chapter 2</p></title><p>Three</p></section>'
+            '</section>'
+            '<section><p>Epilogue</p></section>'
+            '</body></FictionBook>'
+        ).encode('utf-8')
+        reader = Fb2Reader(book_content, images_dir=self.images_dir)
+        part, epilogue = reader.chapters
+        self.assertEqual((part.title, part.id, part.depth), ('Part 1', 'part1', 0))
+        self.assertEqual([(chapter.title, chapter.id, chapter.depth) for chapter in part.children],
+                         [('Chapter 1 Beginning', 'ch1', 1), ('Chapter 2', 'ch2', 1)])
+        self.assertEqual(reader.chapter_paragraphs(part.children[0]), ['Chapter 1', 'Beginning', 'One', 'Two'])
+        self.assertEqual(reader.chapter_paragraphs(part), reader.paragraphs[1:8])
+        self.assertEqual(reader.chapter_paragraphs(epilogue), ['Epilogue'])
+        self.assertIsNone(epilogue.title)
+        self.assertEqual([chapter.id for chapter in part.walk()], ['part1', 'ch1', 'ch2'])
+
 
 if __name__ == '__main__':
     unittest.main()
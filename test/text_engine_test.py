@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from fictionbook.reader import Fb2Reader
+from fictionbook.text_engine import extract_text, iter_text_events
+from fictionbook.text_store import FLAG_CITE, FLAG_POEM, FLAG_TITLE
+
+BOOK = b'''<?xml version="1.0" encoding="utf-8"?>
+<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink">
+<description><title-info><annotation><p>Not in the body</p></annotation></title-info></description>
+<body><title><p>Book</p><empty-line/><p>Sub <emphasis>title</emphasis></p></title>
+<section id="one"><title><p>Chapter
+ one</p></title><p>   </p><p></p><p>Some <strong>strong</strong> text &amp; more</p>
+<section id="nested"><title><p>Nested</p></title><cite><p>Quote</p></cite>
+<poem><stanza><v>Verse <emphasis>one</emphasis></v></stanza></poem></section>
+<p>Outer <emphasis>text <p>inner</p></emphasis> end</p>
+</section><section id="two"><p>Last</p></section></body>
+<body name="notes"><section><p>Note</p></section></body>
+<binary id="cover.jpg" content-type="image/jpeg">AAAA</binary></FictionBook>'''
+
+
+def chapter_tree(chapters):
+    return [(c.title, c.id, c.depth, c.start, c.end, chapter_tree(c.children)) for c in chapters]
+
+
+class Fictionbook2TextEngineTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def test_same_as_reader(self):
+        sources = [BOOK] + [os.path.join(self.TEST_ASSETS_PATH, file_name) for file_name in
+                            ('frost.fb2', 'sol_invictus_book1.fb2', 'transients_in_arcadia.fb2')]
+        with tempfile.TemporaryDirectory() as images_dir:
+            for source in sources:
+                reader = Fb2Reader(source, images_dir, compact=True)
+                paragraphs, chapters = extract_text(source, compact=True)
+                self.assertEqual(list(paragraphs), list(reader.paragraphs))
+                self.assertEqual(list(paragraphs.flags), list(reader.paragraphs.flags))
+                self.assertEqual(chapter_tree(chapters), chapter_tree(reader.chapters))
+
+    def test_events(self):
+        events = list(iter_text_events(BOOK))
+        self.assertEqual(events[0], ('p', 'Book', FLAG_TITLE))
+        self.assertIn(('title', 'Chapter one', FLAG_TITLE), events)
+        self.assertIn(('p', 'Quote', FLAG_CITE), events)
+        self.assertIn(('verse', 'Verse one', FLAG_POEM), events)
+        self.assertNotIn(('p', 'Note', 0), events)
+        starts = [value.id for kind, value, _ in events if kind == 'section_start']
+        ends = [value.id for kind, value, _ in events if kind == 'section_end']
+        self.assertEqual(starts, ['one', 'nested', 'two'])
+        self.assertEqual(ends, ['nested', 'one', 'two'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from fictionbook.reader import Fb2Reader
+from fictionbook.text_store import FLAG_EPIGRAPH, FLAG_POEM, FLAG_TITLE, ParagraphStore
+
+
+class Fictionbook2TextStoreTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def test_paragraph_store(self):
+        paragraphs = ['Первый абзац', 'Second paragraph', '', 'Last one']
+        store = ParagraphStore.from_paragraphs(paragraphs, flags=[FLAG_TITLE, 0, 0, FLAG_POEM])
+        self.assertEqual(len(store), 4)
+        self.assertEqual(list(store), paragraphs)
+        self.assertEqual(store[0], 'Первый абзац')
+        self.assertEqual(store[-1], 'Last one')
+        self.assertEqual(store[1:3], paragraphs[1:3])
+        self.assertEqual(store.flag(3), FLAG_POEM)
+        with self.assertRaises(IndexError):
+            store[4]
+
+        merged = ParagraphStore.from_paragraphs(['Zero'], flags=[0])
+        merged.extend(store)
+        merged.extend(['Plain'])
+        self.assertEqual(list(merged), ['Zero'] + paragraphs + ['Plain'])
+        self.assertEqual(merged.flag(4), FLAG_POEM)
+        self.assertEqual(len(merged.flags), len(merged))
+        self.assertEqual(merged.flag(5), 0)
+
+        merged.extend(ParagraphStore.from_paragraphs(['No flags']))
+        self.assertEqual(len(merged.flags), 7)
+        self.assertEqual(merged.flag(6), 0)
+
+        restored = pickle.loads(pickle.dumps(store))
+        self.assertEqual(list(restored), paragraphs)
+        self.assertEqual(list(restored.flags), [FLAG_TITLE, 0, 0, FLAG_POEM])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, 'paragraphs.bin')
+            store.save(store_path)
+            for use_mmap in (True, False):
+                loaded = ParagraphStore.load(store_path, use_mmap=use_mmap)
+                self.assertEqual(list(loaded), paragraphs)
+                self.assertEqual(loaded[1:], paragraphs[1:])
+                self.assertEqual(loaded.flag(0), FLAG_TITLE)
+                self.assertEqual(list(pickle.loads(pickle.dumps(loaded))), paragraphs)
+                loaded.close()
+
+    def test_compact_reader(self):
+        test_book_path = os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2')
+        with tempfile.TemporaryDirectory() as images_dir:
+            reader = Fb2Reader(test_book_path, images_dir=images_dir)
+            compact_reader = Fb2Reader(test_book_path, images_dir=images_dir, compact=True)
+        self.assertIsInstance(compact_reader.paragraphs, ParagraphStore)
+        self.assertEqual(list(compact_reader.paragraphs), reader.paragraphs)
+        self.assertEqual(compact_reader.paragraphs.flag(0), FLAG_TITLE)
+        self.assertEqual(compact_reader.paragraphs.flag(2), 0)
+        chapter = compact_reader.chapters[1]
+        self.assertEqual(compact_reader.chapter_paragraphs(chapter), reader.paragraphs[chapter.start:chapter.end])
+
+        book_content = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">'
+            '<description><title-info><book-title>Styles</book-title></title-info></description>'
+            '<body><section><epigraph><p>Motto</p></epigraph>'
+            '<poem><title><p>Song</p></title><stanza><v>Verse</v></stanza></poem><p>Text</p></section></body>'
+            '</FictionBook>'
+        ).encode('utf-8')
+        with tempfile.TemporaryDirectory() as images_dir:
+            styles_reader = Fb2Reader(book_content, images_dir=images_dir, compact=True)
+        self.assertEqual(list(styles_reader.paragraphs), ['Motto', 'Song', 'Text'])
+        self.assertEqual(list(styles_reader.paragraphs.flags), [FLAG_EPIGRAPH, FLAG_POEM | FLAG_TITLE, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
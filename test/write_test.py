@@ -0,0 +1,233 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import zipfile
+import tracemalloc
+import xml.etree.ElementTree as et
+
+from fictionbook.reader import Fb2Reader
+from fictionbook.writer import ENCODE_AHEAD_SIZE, Fb2StreamWriter, Fb2Writer
+
+METADATA = {
+    'title-info': {
+        'book-title': 'Frost & Snow',
+        'author': {'first-name': 'Anton', 'last-name': 'Chekhov'},
+    }
+}
+
+
+class Fictionbook2WriterTest(unittest.TestCase):
+    TEST_ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.images_dir = os.path.join(self.temp_dir, 'images')
+        os.mkdir(self.images_dir)
+        reader = Fb2Reader(os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2'), self.images_dir)
+        self.cover_path = reader.get_image('cover.jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write(self):
+        book_path = os.path.join(self.temp_dir, 'book.fb2')
+        writer = Fb2Writer(book_path, self.images_dir)
+        writer.set_metadata(METADATA)
+        writer.set_paragraphs([['First', 'Second'], ['Third']], 'plaintext')
+        writer.write()
+
+        reader = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(reader.paragraphs, ['Frost & Snow', 'First', 'Second', 'Third'])
+        with open(self.cover_path, 'rb') as image_file:
+            self.assertEqual(reader.binaries['cover.jpg'].read(), image_file.read())
+
+        # Base64 text is wrapped into 76-character lines
+        binary_text = reader.binaries['cover.jpg'].element.text
+        self.assertEqual({len(line) for line in binary_text.splitlines()[:-1]}, {76})
+
+    def test_referenced_images(self):
+        reader = Fb2Reader(os.path.join(self.TEST_ASSETS_PATH, 'sol_invictus_book1.fb2'), self.images_dir)
+        reader.images
+
+        outputs = []
+        for image_workers in (1, 4):
+            book_path = os.path.join(self.temp_dir, f'book{image_workers}.fb2')
+            writer = Fb2Writer(book_path, self.images_dir)
+            writer.set_metadata(METADATA)
+            writer.set_paragraphs(['Text'])
+            section = writer.body_elem.find('section')
+            for binary_id in ('i_002.png', 'cover.jpg', 'i_002.png'):
+                et.SubElement(section, 'image', {'l:href': f'#{binary_id}'})
+            self.assertEqual(writer.referenced_images(), ['i_002.png', 'cover.jpg'])
+            writer.write(referenced_only=True, image_workers=image_workers)
+            with open(book_path, 'rb') as book_file:
+                outputs.append(book_file.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+        written = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(list(written.binaries), ['i_002.png', 'cover.jpg'])
+        self.assertEqual(written.binaries['i_002.png'].read(), reader.binaries['i_002.png'].read())
+
+    def test_image_memory(self):
+        image_size = 1024 * 1024
+        for index in range(12):
+            with open(os.path.join(self.images_dir, f'image{index:02}.png'), 'wb') as image_file:
+                image_file.write(os.urandom(image_size))
+
+        # (image_workers, peak memory limit)
+        for image_workers, limit in ((None, image_size // 2), (4, ENCODE_AHEAD_SIZE * 2)):
+            writer = Fb2Writer(os.path.join(self.temp_dir, 'images.fb2'), self.images_dir)
+            writer.set_metadata(METADATA)
+            writer.set_paragraphs(['Text'])
+            tracemalloc.start()
+            try:
+                writer.write(image_workers=image_workers)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, limit)
+
+            reader = Fb2Reader(os.path.join(self.temp_dir, 'images.fb2'), os.path.join(self.temp_dir, 'out'))
+            self.assertEqual(len(reader.binaries), 13)
+
+    def test_compressed_output(self):
+        for file_name in ('book.fb2.zip', 'book.fb2.gz', 'stream.fb2.zip', 'stream.fb2.gz'):
+            book_path = os.path.join(self.temp_dir, file_name)
+            writer = Fb2Writer(book_path, self.images_dir)
+            if file_name.startswith('stream'):
+                with writer.stream(compresslevel=1) as stream_writer:
+                    stream_writer.write_description(METADATA)
+                    stream_writer.start_body()
+                    stream_writer.write_paragraphs(['First', 'Second'])
+            else:
+                writer.set_metadata(METADATA)
+                writer.set_paragraphs(['First', 'Second'])
+                writer.write(compresslevel=1)
+
+            reader = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+            self.assertEqual(reader.paragraphs, ['Frost & Snow', 'First', 'Second'])
+            with open(self.cover_path, 'rb') as image_file:
+                self.assertEqual(reader.binaries['cover.jpg'].read(), image_file.read())
+
+        with zipfile.ZipFile(os.path.join(self.temp_dir, 'book.fb2.zip')) as archive:
+            self.assertEqual(archive.namelist(), ['book.fb2'])
+        with gzip.open(os.path.join(self.temp_dir, 'book.fb2.gz')) as gzip_file:
+            self.assertEqual(gzip_file.read(5), b'<?xml')
+
+        # Compression can be asked for explicitly, whatever the file name is
+        book_path = os.path.join(self.temp_dir, 'book.fb2')
+        writer = Fb2Writer(book_path, self.images_dir)
+        writer.set_metadata(METADATA)
+        writer.set_paragraphs(['Text'])
+        writer.write(compression='gzip')
+        with open(book_path, 'rb') as book_file:
+            self.assertEqual(book_file.read(2), b'\x1f\x8b')
+        with self.assertRaises(ValueError):
+            writer.write(compression='bz2')
+
+    def test_markdown(self):
+        book_path = os.path.join(self.temp_dir, 'markdown.fb2')
+        writer = Fb2Writer(book_path, self.images_dir)
+        writer.set_metadata(METADATA)
+        writer.set_paragraphs([
+            'Intro with a note[^1].',
+            '# Chapter & one',
+            '> Quote line\n> -- Author',
+            'Some *emphasis*, **strong** and `code` text',
+            '![Cover](images/cover.jpg)',
+            '- First\n- Second',
+            '## Nested',
+            'Inner',
+            '[^1]: The *note*.',
+        ], 'markdown')
+        writer.write()
+
+        reader = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(reader.paragraphs, ['Frost & Snow', 'Intro with a note1.', 'Chapter & one', 'Quote line',
+                                             'Some emphasis, strong and code text', '• First', '• Second',
+                                             'Nested', 'Inner'])
+        self.assertEqual([(chapter.title, [child.title for child in chapter.children])
+                          for chapter in reader.chapters], [(None, []), ('Chapter & one', ['Nested'])])
+
+        prefix = '{http://www.gribuser.ru/xml/fictionbook/2.0}'
+        body, notes = reader.root.findall(f'{prefix}body')
+        chapter = body.findall(f'{prefix}section')[1]
+        self.assertEqual(chapter.find(f'{prefix}epigraph/{prefix}text-author').text, 'Author')
+        paragraph = chapter.findall(f'{prefix}p')[0]
+        self.assertEqual([child.tag for child in paragraph], [f'{prefix}emphasis', f'{prefix}strong', f'{prefix}code'])
+        image = chapter.find(f'{prefix}image')
+        self.assertEqual(image.get('{http://www.w3.org/1999/xlink}href'), '#cover.jpg')
+
+        link = body.find(f'.//{prefix}a')
+        self.assertEqual(link.get('type'), 'note')
+        note_id = link.get('{http://www.w3.org/1999/xlink}href')[1:]
+        self.assertEqual(notes.get('name'), 'notes')
+        note = notes.find(f'{prefix}section')
+        self.assertEqual(note.get('id'), note_id)
+        self.assertEqual(''.join(note.find(f'{prefix}p').itertext()), 'The note.')
+
+    def test_stream_writer(self):
+        book_path = os.path.join(self.temp_dir, 'stream.fb2')
+        with Fb2Writer(book_path, self.images_dir).stream() as writer:
+            writer.write_description(METADATA)
+            writer.start_body()
+            writer.start_section(title='Chapter <1>', section_id='ch1')
+            writer.write_paragraphs(['First', 'a < b'])
+            writer.write_empty_line()
+            writer.write_element(et.fromstring('<p>Some <emphasis>inline</emphasis> markup</p>'))
+            writer.start_section(title=['Nested', 'chapter'])
+            writer.write_paragraph('Inner')
+
+        reader = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(reader.paragraphs, ['Frost & Snow', 'Chapter <1>', 'First', 'a < b',
+                                             'Some inline markup', 'Nested', 'chapter', 'Inner'])
+        chapter, = reader.chapters
+        self.assertEqual((chapter.title, chapter.id), ('Chapter <1>', 'ch1'))
+        self.assertEqual(chapter.children[0].title, 'Nested chapter')
+        with open(self.cover_path, 'rb') as image_file:
+            self.assertEqual(reader.binaries['cover.jpg'].read(), image_file.read())
+
+        with open(book_path, 'r', encoding='utf-8') as book_file:
+            content = book_file.read()
+        self.assertIn('\n      <p>First</p>\n', content)
+        self.assertIn('<empty-line/>', content)
+
+    def test_stream_writer_parsed_element(self):
+        section = et.fromstring(
+            '<section xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink">'
+            '<image l:href="#cover.jpg"/>'
+            '<p>See <a l:href="#n1" type="note">1</a> <emphasis>here</emphasis></p></section>')
+        book_path = os.path.join(self.temp_dir, 'parsed.fb2')
+        with Fb2StreamWriter(book_path, self.images_dir) as writer:
+            writer.write_description(METADATA)
+            writer.start_body()
+            writer.write_element(section)
+            with self.assertRaises(ValueError):
+                writer.write_element(et.Element('{http://www.w3.org/1999/xhtml}p'))
+
+        reader = Fb2Reader(book_path, os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(reader.paragraphs, ['Frost & Snow', 'See 1 here'])
+        prefix = '{http://www.gribuser.ru/xml/fictionbook/2.0}'
+        xlink_href = '{http://www.w3.org/1999/xlink}href'
+        written = reader.root.find(f'{prefix}body/{prefix}section')
+        self.assertEqual(written.find(f'{prefix}image').get(xlink_href), '#cover.jpg')
+        link = written.find(f'{prefix}p/{prefix}a')
+        self.assertEqual((link.get(xlink_href), link.get('type')), ('#n1', 'note'))
+
+    def test_stream_writer_order(self):
+        with Fb2StreamWriter(os.path.join(self.temp_dir, 'order.fb2'), pretty_xml=False) as writer:
+            with self.assertRaises(ValueError):
+                writer.start_body()
+            writer.write_description(METADATA)
+            with self.assertRaises(ValueError):
+                writer.write_paragraph('No body yet')
+            with self.assertRaises(ValueError):
+                writer.write_description(METADATA)
+            writer.start_body(title='Body')
+            writer.write_paragraph('Text')
+
+
+if __name__ == '__main__':
+    unittest.main()